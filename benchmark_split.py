@@ -0,0 +1,99 @@
+"""分割输出性能测试
+
+把输入文件按固定页数切分为若干输出文档，分别用逐页插入和按连续区间插入生成，
+比较每秒处理的页数：
+
+    python benchmark_split.py 图纸.pdf --pages-per-output 50
+
+加上 --profiles 时比较各输出优化方案（见OPTIMIZE_PROFILES）的速度和输出文件大小。
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import fitz  # PyMuPDF
+
+from pdf_splitter_engine import insert_pages, optimize_and_save_pdf, ImageCache, OPTIMIZE_PROFILES
+
+
+def insert_per_page(output_doc, src_doc, pages):
+    """逐页插入（对比用）"""
+    for page_index in pages:
+        output_doc.insert_pdf(src_doc, from_page=page_index, to_page=page_index)
+
+
+def run(src_doc, chunks, insert_func, save):
+    """生成所有输出文档，返回 (插入耗时, 保存耗时)"""
+    insert_time = 0.0
+    save_time = 0.0
+    for pages in chunks:
+        start = time.perf_counter()
+        output_doc = fitz.open()
+        insert_func(output_doc, src_doc, pages)
+        inserted = time.perf_counter()
+        if save:
+            output_doc.tobytes(garbage=4, deflate=True)
+        insert_time += inserted - start
+        save_time += time.perf_counter() - inserted
+        output_doc.close()
+    return insert_time, save_time
+
+
+def run_profile(src_doc, chunks, profile, output_dir):
+    """按优化方案生成并保存所有输出文档，返回 (耗时, 输出文件总大小)"""
+    image_cache = ImageCache()  # 每个方案单独缓存，结果互不影响
+    elapsed = 0.0
+    size = 0
+    for i, pages in enumerate(chunks):
+        output_path = os.path.join(output_dir, f"{i}.pdf")
+        start = time.perf_counter()
+        output_doc = fitz.open()
+        insert_pages(output_doc, src_doc, pages)
+        optimize_and_save_pdf(output_doc, output_path, profile, image_cache=image_cache)
+        output_doc.close()
+        elapsed += time.perf_counter() - start
+        size += os.path.getsize(output_path)
+    return elapsed, size
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmark_split", description="比较逐页插入和按区间插入的分割速度")
+    parser.add_argument("inputs", nargs="+", help="用于测试的PDF文件")
+    parser.add_argument("-n", "--pages-per-output", type=int, default=50, help="每个输出文档的页数（默认: 50）")
+    parser.add_argument("--save", action="store_true", help="同时测试保存（garbage=4，大文件较慢）")
+    parser.add_argument("--profiles", action="store_true", help="比较各输出优化方案的速度和文件大小")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    for file_path in args.inputs:
+        with fitz.open(file_path) as src_doc:
+            page_count = len(src_doc)
+            chunks = [list(range(start, min(start + args.pages_per_output, page_count)))
+                      for start in range(0, page_count, args.pages_per_output)]
+            print(f"{file_path}: {page_count} 页, {len(chunks)} 个输出文档")
+
+            for name, insert_func in (("逐页插入", insert_per_page), ("区间插入", insert_pages)):
+                insert_time, save_time = run(src_doc, chunks, insert_func, args.save)
+                line = f"  {name}: 插入 {page_count / insert_time:.1f} 页/秒"
+                if args.save:
+                    line += f", 含保存 {page_count / (insert_time + save_time):.1f} 页/秒"
+                print(line)
+
+            if args.profiles:
+                source_size = os.path.getsize(file_path)
+                for name, profile in OPTIMIZE_PROFILES.items():
+                    with tempfile.TemporaryDirectory() as output_dir:
+                        elapsed, size = run_profile(src_doc, chunks, name, output_dir)
+                    print(f"  {profile['label']}({name}): {page_count / elapsed:.1f} 页/秒, "
+                          f"输出 {size / 1024 / 1024:.1f} MB（原文件的 {size / source_size:.0%}）")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""PDF分割工具命令行入口
+
+不打开窗口，使用保存的模板完成识别和分割：
+
+    python pdf_splitter.py -t 模板.json -o 输出目录 "图纸/*.pdf"
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import multiprocessing
+
+from pdf_splitter_engine import (
+    load_templates, templates_mode, get_page_count, recognize_files, build_regions, split_files,
+    RecognitionCache, default_cache_path, format_image_stats, OPTIMIZE_PROFILES, DEFAULT_OPTIMIZE_PROFILE,
+    MAX_DECODED_PIXELS, SplitJournal,
+)
+
+
+def expand_inputs(patterns):
+    """展开输入的通配符，去重并保持顺序
+
+    返回 (files, missing)：missing为不存在的文件和没有匹配任何文件的通配符
+    """
+    files = []
+    missing = []
+    seen = set()
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        matches = [file_path for file_path in matches if os.path.isfile(file_path)]
+        if not matches:
+            missing.append(pattern)
+        for file_path in matches:
+            if file_path not in seen:
+                seen.add(file_path)
+                files.append(file_path)
+    return files, missing
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="pdf_splitter", description="按页码/文件名模板批量分割PDF")
+    parser.add_argument("inputs", nargs="+", help="输入PDF文件或通配符，如 \"图纸/**/*.pdf\"")
+    parser.add_argument("-o", "--output-dir", required=True, help="输出目录")
+    parser.add_argument("-t", "--template", required=True, help="在图形界面中保存的模板文件")
+    parser.add_argument("-q", "--quiet", action="store_true", help="只输出汇总信息")
+    parser.add_argument("--cache", default=default_cache_path(), help="识别结果缓存文件（默认: %(default)s）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用识别结果缓存，所有页面重新识别")
+    parser.add_argument("-p", "--profile", choices=list(OPTIMIZE_PROFILES), default=DEFAULT_OPTIMIZE_PROFILE,
+                        help="输出文件优化方案: " + ", ".join(f"{name}={profile['label']}"
+                                                         for name, profile in OPTIMIZE_PROFILES.items())
+                             + "（默认: %(default)s）")
+    parser.add_argument("--target-dpi", type=int, help="重新压缩图像时把分辨率更高的图像缩小到此分辨率（仅max方案）")
+    parser.add_argument("--max-megapixels", type=int, default=MAX_DECODED_PIXELS // 1000000,
+                        help="同时解码的图像像素总数上限（百万像素，默认: %(default)s），内存不足时调低")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="重新生成所有输出文件（默认跳过输出目录任务日志中已完成且未修改的文件）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.target_dpi and not OPTIMIZE_PROFILES[args.profile]['recompress_images']:
+        print(f"--target-dpi 只在重新压缩图像的方案中有效（当前方案: {args.profile}）", file=sys.stderr)
+        return 2
+
+    templates = load_templates(args.template)
+    template_mode = templates_mode(templates)
+
+    files, missing = expand_inputs(args.inputs)
+    for pattern in missing:
+        print(f"{pattern}: 没有找到匹配的文件", file=sys.stderr)
+    if not files:
+        print("没有找到输入文件", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    cache = None if args.no_cache else RecognitionCache(args.cache)
+    journal = None if args.no_resume else SplitJournal(args.output_dir)
+
+    # 所有文件一起识别和分割：页数或输出文件较少的文件也能由进程池同时处理
+    failed = {}
+    start = time.perf_counter()
+    recognized = recognize_files(files, templates, cache=cache, errors=failed)
+    recognize_time = time.perf_counter() - start
+
+    jobs = []
+    for file_path in files:
+        if file_path in recognized:
+            page_numbers, filenames = recognized[file_path]
+            regions, custom_filenames = build_regions(page_numbers, filenames)
+            jobs.append((file_path, regions, custom_filenames))
+
+    image_stats = {}
+    start = time.perf_counter()
+    output_paths = split_files(jobs, args.output_dir, template_mode, image_stats=image_stats, profile=args.profile,
+                               target_dpi=args.target_dpi, max_pixels=args.max_megapixels * 1000000,
+                               journal=journal, errors=failed)
+    split_time = time.perf_counter() - start
+
+    total_pages = 0
+    total_outputs = 0
+    for index, file_path in enumerate(files, 1):
+        if file_path in failed:
+            print(f"[{index}/{len(files)}] {file_path}: 处理失败: {failed[file_path]}", file=sys.stderr)
+            continue
+        total_pages += get_page_count(file_path)
+        total_outputs += len(output_paths[file_path])
+        if not args.quiet:
+            page_numbers, filenames = recognized[file_path]
+            print(f"[{index}/{len(files)}] {file_path}: 识别 {len(page_numbers)} 页页码, "
+                  f"{sum(1 for name in filenames.values() if name)} 页文件名, "
+                  f"生成 {len(output_paths[file_path])} 个文件")
+
+    if cache:
+        cache.close()
+
+    print(f"完成: {len(files) - len(failed)}/{len(files)} 个文件, 生成 {total_outputs} 个文件")
+    if journal and journal.skipped:
+        print(f"跳过 {journal.skipped} 个上次已生成的文件")
+    print(f"识别耗时 {recognize_time:.2f}s, 分割耗时 {split_time:.2f}s")
+    if total_pages and recognize_time:
+        print(f"识别速度 {total_pages / recognize_time:.1f} 页/秒")
+    if image_stats:
+        print(format_image_stats(image_stats))
+
+    return 1 if failed or missing else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
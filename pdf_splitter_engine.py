@@ -0,0 +1,1755 @@
+"""PDF分割引擎
+
+不依赖Tkinter的识别与分割逻辑，图形界面和批处理共用。
+所有坐标均为PDF坐标系（单位：点）。
+"""
+import os
+import re
+import io
+import json
+import math
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import fitz  # PyMuPDF
+from PIL import Image
+
+# 标记未识别到内容的页面
+NO_CONTENT = "[无内容]"
+
+# 文件名中不允许出现的字符
+INVALID_FILENAME_CHARS = r'[\\/*?:"<>|]'
+
+# 默认行容差（点）：界面默认缩放为2.0时相当于5个像素
+DEFAULT_LINE_TOLERANCE = 2.5
+
+# 页数少于此值时不启动进程池（进程启动的开销大于收益）
+PARALLEL_MIN_PAGES = 200
+
+# 每个工作单元至少包含的页数
+MIN_CHUNK_PAGES = 16
+
+# 输出文件少于此数时在当前进程中顺序生成
+PARALLEL_MIN_OUTPUTS = 8
+
+# 多进程分割时每个工作单元最多包含的输出文件数；单元完成时才更新进度和检查取消，
+# 单元太大时取消要等较长时间，太小时源文件要反复打开
+MAX_UNIT_OUTPUTS = 16
+
+# 识别结果缓存的版本，识别方法改变时增加，使旧的缓存结果失效
+RECOGNITION_CACHE_VERSION = 2
+
+# 已优化图像缓存的最大容量（字节）
+IMAGE_CACHE_BYTES = 64 * 1024 * 1024
+
+# 同时解码的图像像素总数上限（RGB图像约3字节/像素），多进程分割时由各进程平分
+MAX_DECODED_PIXELS = 256 * 1000 * 1000
+
+# 每个进程中已提取、等待重新压缩的图像数据总量上限（字节），超过时等待已提交的图像压缩完成
+MAX_PENDING_IMAGE_BYTES = 64 * 1024 * 1024
+
+# 每个进程中重新压缩图像的线程数（Pillow解码和编码时释放GIL）
+IMAGE_WORKERS = min(4, os.cpu_count() or 1)
+
+# 分割任务日志的文件名，保存在输出目录中，见SplitJournal
+SPLIT_JOURNAL_NAME = ".pdf_splitter_journal.jsonl"
+
+# 页面文字缓存最多保留的页数（显示列表包含页面全部内容，图纸页面可能较大）
+TEXT_CACHE_PAGES = 16
+
+# 输出文件的优化方案，在速度和文件大小之间取舍（各方案的测试数据见benchmark_split.py）
+#   label: 界面中显示的名称
+#   recompress_images: 是否重新压缩图像（有损）
+#   save: 传给Document.save的参数
+OPTIMIZE_PROFILES = {
+    # 直接保存复制的页面，不做任何优化
+    "fast": {'label': "快速复制", 'recompress_images': False, 'save': {}},
+    # 合并重复对象、整理并压缩内容流，不改变图像
+    "lossless": {'label': "无损压缩", 'recompress_images': False,
+                 'save': {'garbage': 3, 'clean': True, 'deflate': True}},
+    # 在无损压缩的基础上重新压缩图像
+    "max": {'label': "最大压缩", 'recompress_images': True,
+            'save': {'garbage': 4, 'clean': True, 'deflate': True, 'deflate_images': True, 'deflate_fonts': True}},
+}
+DEFAULT_OPTIMIZE_PROFILE = "max"
+
+
+def canvas_to_pdf_rect(coords, zoom):
+    """将画布坐标转换为PDF坐标"""
+    x1, y1, x2, y2 = coords
+    return (x1 / zoom, y1 / zoom, x2 / zoom, y2 / zoom)
+
+
+def make_template(mode=None, page_rect=None, total_rect=None, filename_rects=None):
+    """创建识别模板
+
+    参数:
+        mode: 页码模式 ("double", "single" 或 None)
+        page_rect: "第n张"区域（单区域模式下为页码区域）
+        total_rect: "共m张"区域，仅双区域模式使用
+        filename_rects: 文件名区域列表，按框选顺序排列
+    """
+    return {
+        'mode': mode,
+        'page_rect': tuple(page_rect) if page_rect else None,
+        'total_rect': tuple(total_rect) if total_rect else None,
+        'filename_rects': [tuple(rect) for rect in (filename_rects or [])],
+    }
+
+
+def page_size_key(page):
+    """返回页面尺寸标识，如 "842x595"（四舍五入到整数）"""
+    return f"{round(page.rect.width)}x{round(page.rect.height)}"
+
+
+class FileIndex:
+    """PDF文件的元数据索引：页数、各图幅的页面、文件大小和修改时间、内容哈希
+
+    文件第一次用到（或添加到列表）时打开一次读取页数，之后文件大小或修改时间变化时才重新读取；
+    图幅（需要加载每一页）和内容哈希在第一次需要时计算。
+    列表、识别和分割都从这里取页数和图幅，不再反复打开文件。
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def entry(self, file_path):
+        """返回文件的元数据 {'size', 'mtime_ns', 'page_count', 'page_sizes', 'hash'}，文件变化时重新读取
+
+        page_sizes和hash尚未计算时为None
+        """
+        stat = os.stat(file_path)
+        entry = self.entries.get(file_path)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry
+
+        with fitz.open(file_path) as pdf_doc:
+            page_count = len(pdf_doc)
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'page_count': page_count,
+                 'page_sizes': None, 'hash': None}
+        self.entries[file_path] = entry
+        return entry
+
+    def add(self, file_path):
+        """读取文件的页数（添加文件时调用）"""
+        self.entry(file_path)
+
+    def forget(self, file_path):
+        """移除文件的元数据"""
+        self.entries.pop(file_path, None)
+
+    def page_count(self, file_path):
+        return self.entry(file_path)['page_count']
+
+    def page_sizes(self, file_path):
+        """返回 {size_key: [page_nums]}"""
+        entry = self.entry(file_path)
+        if entry['page_sizes'] is None:
+            page_sizes = {}
+            with fitz.open(file_path) as pdf_doc:
+                for page_num in range(len(pdf_doc)):
+                    page_sizes.setdefault(page_size_key(pdf_doc[page_num]), []).append(page_num)
+            entry['page_sizes'] = page_sizes
+        return entry['page_sizes']
+
+    def file_hash(self, file_path, cache=None):
+        """返回文件内容的哈希，有RecognitionCache时使用其中保存的结果"""
+        entry = self.entry(file_path)
+        if entry['hash'] is None:
+            entry['hash'] = cache.file_hash(file_path) if cache else file_content_hash(file_path)
+        return entry['hash']
+
+
+# 进程内共用的文件元数据索引
+file_index = FileIndex()
+
+
+def detect_page_sizes(file_path):
+    """识别文件中的不同图幅尺寸，返回 {size_key: [page_nums]}"""
+    return {size_key: list(pages) for size_key, pages in file_index.page_sizes(file_path).items()}
+
+
+def get_page_count(file_path):
+    """返回PDF文件的页数"""
+    return file_index.page_count(file_path)
+
+
+def extract_number_from_text(text):
+    """从文本中提取第一个数字"""
+    numbers = re.findall(r'\d+', text)
+    return int(numbers[0]) if numbers else None
+
+
+def sanitize_filename(name):
+    """替换文件名中的非法字符"""
+    return re.sub(INVALID_FILENAME_CHARS, '_', name)
+
+
+def _clean_text(text):
+    """将多行文本合并为一行并压缩空白"""
+    text = text.replace('\n', ' ').replace('\r', ' ')
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _block_spans(blocks):
+    """从get_text("dict")的blocks中取出所有span，返回 [(y_pos, x_pos, text), ...]"""
+    all_spans = []
+    for block in blocks:
+        if block["type"] == 0:  # 文本块
+            for line in block["lines"]:
+                for span in line["spans"]:
+                    # 使用span的垂直中点表示行位置
+                    y_pos = (span["bbox"][1] + span["bbox"][3]) / 2
+                    x_pos = span["bbox"][0]
+                    all_spans.append((y_pos, x_pos, span["text"]))
+    return all_spans
+
+
+def _join_spans(all_spans, line_tolerance):
+    """将 (y_pos, x_pos, text) 列表按行分组排序后合并为文本
+
+    y坐标差小于line_tolerance视为同一行，行内从左到右排序。
+    """
+    if not all_spans:
+        return ""
+
+    all_spans.sort(key=lambda x: (x[0], x[1]))
+
+    # 将span分组到不同的行
+    lines = []
+    current_line = [all_spans[0]]
+    last_y = all_spans[0][0]
+    for span in all_spans[1:]:
+        if abs(span[0] - last_y) < line_tolerance:
+            current_line.append(span)
+        else:
+            current_line.sort(key=lambda x: x[1])
+            lines.append(current_line)
+            current_line = [span]
+            last_y = span[0]
+    current_line.sort(key=lambda x: x[1])
+    lines.append(current_line)
+
+    return " ".join(" ".join(span[2] for span in line) for line in lines)
+
+
+def extract_text_from_rect(page, rect, line_tolerance=DEFAULT_LINE_TOLERANCE):
+    """从页面指定区域提取文本
+
+    先按行分组（y坐标差小于line_tolerance视为同一行），行内从左到右排序。
+    """
+    rect = fitz.Rect(rect)
+    try:
+        blocks = page.get_text("dict", clip=rect)["blocks"]
+        result_text = _join_spans(_block_spans(blocks), line_tolerance)
+    except Exception as e:
+        print(f"Warning: Text extraction using dict failed, falling back. Error: {e}")
+        # 回退到简单模式
+        try:
+            result_text = page.get_text("text", clip=rect)
+        except Exception:
+            result_text = ""
+
+    return _clean_text(result_text)
+
+
+class PageText:
+    """页面内容只解析一次，之后可按任意区域提取文字
+
+    页面先转换为显示列表（display list），每次查询只在显示列表上运行一次带裁剪区域的文字提取，
+    不再重新解析页面内容流。提取结果与 page.get_text(..., clip=rect) 相同。
+    """
+
+    # 与 get_text("text") / get_text("dict") 相同的提取选项（dict不需要保留图像）
+    TEXT_FLAGS = fitz.TEXTFLAGS_TEXT
+    DICT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+    def __init__(self, page):
+        self.page = page
+        self.display_list = page.get_displaylist()
+        # 显示列表使用旋转后的坐标，get_text使用未旋转的页面坐标
+        self.matrix = page.derotation_matrix
+
+    def _textpage(self, rect, flags):
+        rect = fitz.Rect(rect)
+        textpage = fitz.TextPage(rect)
+        device = fitz.Device(textpage, flags)
+        self.display_list.run(device, self.matrix, rect)
+        del device
+        textpage.parent = self.page
+        return textpage
+
+    def plain_text(self, rect):
+        """返回区域内的文本，同 page.get_text("text", clip=rect)"""
+        return self._textpage(rect, self.TEXT_FLAGS).extractText()
+
+    def sorted_text(self, rect, line_tolerance=DEFAULT_LINE_TOLERANCE):
+        """按行排序返回区域内的文本，同 extract_text_from_rect"""
+        try:
+            blocks = self._textpage(rect, self.DICT_FLAGS).extractDICT()["blocks"]
+            result_text = _join_spans(_block_spans(blocks), line_tolerance)
+        except Exception as e:
+            print(f"Warning: Text extraction using dict failed, falling back. Error: {e}")
+            try:
+                result_text = self.plain_text(rect)
+            except Exception:
+                result_text = ""
+        return _clean_text(result_text)
+
+
+class PageTextCache:
+    """单个PDF文档的页面文字缓存，用于在同一页上反复框选
+
+    每页第一次查询时解析为PageText，之后的区域查询只在显示列表上进行，
+    不再重新解析页面内容流。最多保留max_pages页，最久未使用的页面先淘汰。
+    """
+
+    def __init__(self, doc, max_pages=TEXT_CACHE_PAGES):
+        self.doc = doc
+        self.max_pages = max_pages
+        self.pages = OrderedDict()
+
+    def page(self, page_num):
+        """返回指定页面的PageText"""
+        page_text = self.pages.get(page_num)
+        if page_text is None:
+            page_text = PageText(self.doc[page_num])
+            self.pages[page_num] = page_text
+            if len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+        else:
+            self.pages.move_to_end(page_num)
+        return page_text
+
+    def extract_text(self, page_num, rect, line_tolerance=DEFAULT_LINE_TOLERANCE):
+        """从指定页面的区域提取文本，同extract_text_from_rect"""
+        return self.page(page_num).sorted_text(rect, line_tolerance)
+
+
+def template_regions(template):
+    """返回模板中需要识别的区域 [(kind, rect), ...]
+
+    kind为"number"（页码区域，提取其中的数字）或"text"（文件名区域，提取按行排序的文本）。
+    顺序为：当前页码区域、总页数区域（仅双区域模式）、各文件名区域。
+    """
+    regions = []
+    if template.get('page_rect'):
+        regions.append(("number", tuple(template['page_rect'])))
+        if template.get('mode') == "double" and template.get('total_rect'):
+            regions.append(("number", tuple(template['total_rect'])))
+    for rect in template.get('filename_rects') or []:
+        regions.append(("text", tuple(rect)))
+    return regions
+
+
+def evaluate_region(page_text, region, line_tolerance=DEFAULT_LINE_TOLERANCE):
+    """识别页面上的单个区域，返回数字（未识别到时为None）或文本"""
+    kind, rect = region
+    if kind == "number":
+        return extract_number_from_text(page_text.plain_text(rect))
+    return page_text.sorted_text(rect, line_tolerance)
+
+
+def combine_region_values(template, values, page_count):
+    """由template_regions各区域的识别值得到页面的识别结果
+
+    返回 (page_number, filename)：
+        page_number: {'current_page': n, 'total_pages': m}，未识别到当前页码时为None，
+                     未识别到总页数时使用文件总页数
+        filename: 各文件名区域的文本用"-"连接，模板没有文件名区域时为None
+    """
+    values = list(values)
+
+    page_number = None
+    if template.get('page_rect'):
+        current_number = values.pop(0)
+        total_number = None
+        if template.get('mode') == "double" and template.get('total_rect'):
+            total_number = values.pop(0)
+        if current_number:
+            page_number = {
+                'current_page': current_number,
+                'total_pages': total_number if total_number else page_count,
+            }
+
+    filename = None
+    if template.get('filename_rects'):
+        filename = sanitize_filename("-".join(text for text in values if text))
+
+    return page_number, filename
+
+
+def scan_regions(file_path, regions, pages=None, progress=None, line_tolerance=DEFAULT_LINE_TOLERANCE):
+    """识别文件中指定页面上的区域，每页只解析一次
+
+    参数:
+        regions: [(kind, rect), ...]，见template_regions
+        pages: 要处理的页码列表（从0开始），None表示所有页面
+        progress: 进度回调 progress(done, total)
+
+    返回 {page_num: [value, ...]}，值与regions一一对应
+    """
+    results = {}
+    with fitz.open(file_path) as pdf_doc:
+        if pages is None:
+            pages = range(len(pdf_doc))
+        total = len(pages)
+        for done, page_num in enumerate(pages, 1):
+            page_text = PageText(pdf_doc[page_num])
+            results[page_num] = [evaluate_region(page_text, region, line_tolerance) for region in regions]
+            if progress:
+                progress(done, total)
+    return results
+
+
+def make_work_units(pages_by_file, workers):
+    """将 [(file_path, pages), ...] 拆分为 (file_path, 页面块) 工作单元
+
+    每个工作进程大约分到4个单元，以便负载均衡。
+    """
+    total_pages = sum(len(pages) for _, pages in pages_by_file)
+    chunk_size = max(MIN_CHUNK_PAGES, -(-total_pages // (workers * 4)))
+    units = []
+    for file_path, pages in pages_by_file:
+        pages = list(pages)
+        for i in range(0, len(pages), chunk_size):
+            units.append((file_path, pages[i:i + chunk_size]))
+    return units
+
+
+def iter_scan_parallel(pages_by_file, regions, workers=None, line_tolerance=DEFAULT_LINE_TOLERANCE, errors=None):
+    """使用多进程识别多个文件上的区域，按工作单元完成的顺序逐个返回结果
+
+    每个工作进程单独打开PDF文件，处理一个 (文件, 页面块) 工作单元。
+    页数较少或只有一个CPU时在当前进程中顺序处理。
+
+    参数:
+        pages_by_file: [(file_path, [page_num, ...]), ...]
+        regions: [(kind, rect), ...]，见template_regions
+        workers: 进程数，默认使用CPU核数
+        errors: 可选的字典，收集出错的文件 {file_path: 异常}，出错的工作单元不产生结果，
+            其他单元继续处理；不给出时直接抛出异常
+
+    依次产生 (file_path, pages, results)，results格式同scan_regions
+    """
+    workers = workers or os.cpu_count() or 1
+    total_pages = sum(len(pages) for _, pages in pages_by_file)
+
+    if workers <= 1 or total_pages < PARALLEL_MIN_PAGES:
+        for file_path, pages in make_work_units(pages_by_file, 1):
+            try:
+                results = scan_regions(file_path, regions, pages, line_tolerance=line_tolerance)
+            except Exception as e:
+                if errors is None:
+                    raise
+                errors.setdefault(file_path, e)
+                continue
+            yield file_path, pages, results
+        return
+
+    units = make_work_units(pages_by_file, workers)
+    executor = ProcessPoolExecutor(max_workers=min(workers, len(units)))
+    try:
+        futures = {executor.submit(scan_regions, file_path, regions, pages, line_tolerance=line_tolerance):
+                   (file_path, pages) for file_path, pages in units}
+        for future in as_completed(futures):
+            file_path, pages = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                if errors is None:
+                    raise
+                errors.setdefault(file_path, e)
+                continue
+            yield file_path, pages, results
+    finally:
+        # 调用方提前结束（例如取消识别）时，不再等待尚未开始的工作单元
+        executor.shutdown(cancel_futures=True)
+
+
+def _plan_region_scan(cache, file_hash, regions, pages, line_tolerance):
+    """查询缓存，找出每页还需要识别的区域
+
+    返回 (known, pending)：
+        known: 各区域已知的值 [{page_num: value}, ...]，与regions一一对应
+        pending: {需要识别的区域序号元组: [page_num, ...]}
+    """
+    known = [cache.load(file_hash, region, line_tolerance) if cache else {} for region in regions]
+    pending = {}
+    for page_num in pages:
+        missing = tuple(i for i, values in enumerate(known) if page_num not in values)
+        if missing:
+            pending.setdefault(missing, []).append(page_num)
+    return known, pending
+
+
+def iter_scan_cached(pages_by_file, template, cache=None, workers=None,
+                     line_tolerance=DEFAULT_LINE_TOLERANCE, progress=None, cancel_event=None, errors=None):
+    """使用多进程识别多个文件，按区域复用缓存的结果
+
+    每个区域单独缓存，只有坐标变化（缓存中没有）的区域才重新识别，
+    例如只修改了"共m张"区域时，"第n张"和文件名区域直接使用缓存结果。
+    每个文件先返回所有区域都已缓存的页面，其余页面再使用多进程识别，新结果写入缓存。
+    cache为None时所有页面都重新识别。
+
+    参数:
+        progress: 查询缓存阶段的进度回调 progress(done, total, file_path)，done和total为文件数，
+            每个文件计算哈希和查询缓存之前调用（第一次处理大量文件时，计算哈希需要较长时间）
+        cancel_event: 可选的threading.Event，查询缓存阶段每个文件之前检查，设置后不再产生结果
+        errors: 可选的字典，收集出错的文件 {file_path: 异常}，见iter_scan_parallel；
+            出错文件的部分页面可能已经产生了结果
+
+    依次产生 (file_path, pages, {page_num: (page_number, filename)})，格式同combine_region_values
+    """
+    regions = template_regions(template)
+    file_info = {}
+    scan_groups = {}  # {需要识别的区域序号元组: [(file_path, pages), ...]}
+
+    for done, (file_path, pages) in enumerate(pages_by_file):
+        if cancel_event and cancel_event.is_set():
+            return
+        if progress:
+            progress(done, len(pages_by_file), file_path)
+        try:
+            file_hash = file_index.file_hash(file_path, cache) if cache else None
+            known, pending = _plan_region_scan(cache, file_hash, regions, pages, line_tolerance)
+            page_count = get_page_count(file_path)
+        except Exception as e:
+            if errors is None:
+                raise
+            errors.setdefault(file_path, e)
+            continue
+        file_info[file_path] = (file_hash, known, page_count)
+
+        pending_pages = set()
+        for indexes, page_nums in pending.items():
+            scan_groups.setdefault(indexes, []).append((file_path, page_nums))
+            pending_pages.update(page_nums)
+
+        cached_pages = [page_num for page_num in pages if page_num not in pending_pages]
+        if cached_pages:
+            yield file_path, cached_pages, {
+                page_num: combine_region_values(template, [values[page_num] for values in known], page_count)
+                for page_num in cached_pages
+            }
+
+    for indexes, group in scan_groups.items():
+        scan_list = [regions[i] for i in indexes]
+        for file_path, pages, results in iter_scan_parallel(group, scan_list, workers, line_tolerance, errors):
+            file_hash, known, page_count = file_info[file_path]
+            for j, i in enumerate(indexes):
+                new_values = {page_num: values[j] for page_num, values in results.items()}
+                known[i].update(new_values)
+                if cache:
+                    cache.store(file_hash, regions[i], new_values, line_tolerance)
+
+            # 同一页的其他区域可能还在后面的分组中识别，这里只返回所有区域都已知的页面
+            ready_pages = [page_num for page_num in pages if all(page_num in values for values in known)]
+            if ready_pages:
+                yield file_path, ready_pages, {
+                    page_num: combine_region_values(template, [values[page_num] for values in known], page_count)
+                    for page_num in ready_pages
+                }
+
+
+def group_double_mode(regions):
+    """双区域模式的页面分组
+
+    按（总张数, 推算的起始页）分组，返回 [(total_pages, [(page_index, current_page), ...]), ...]
+    """
+    documents = []
+    temp_docs = {}
+
+    for region in regions:
+        if 'current_page' not in region:
+            continue
+
+        current_page = region['current_page']
+        total_pages = region['total_pages']
+        page_index = region['page']
+
+        doc_start_index = page_index - (current_page - 1)
+        doc_key = (total_pages, doc_start_index)
+        temp_docs.setdefault(doc_key, []).append((page_index, current_page))
+
+    for (total_pages, _), pages in temp_docs.items():
+        pages.sort(key=lambda x: x[1])
+        documents.append((total_pages, pages))
+
+    # 按文档第一页的页码排序
+    documents.sort(key=lambda x: x[1][0][1])
+    return documents
+
+
+def group_single_mode(regions):
+    """单区域模式的页面分组
+
+    页码重新从1开始时开始新的一组，返回 [(start_page, end_page, page_numbers), ...]
+    """
+    documents = []
+    current_group = []
+    last_page_number = None
+
+    sorted_regions = sorted((r for r in regions if 'current_page' in r), key=lambda x: x['page'])
+
+    for region in sorted_regions:
+        current_number = region['current_page']
+
+        if last_page_number is None or current_number == 1:
+            if current_group:
+                documents.append((current_group[0]['page'], current_group[-1]['page'],
+                                  [r['current_page'] for r in current_group]))
+            current_group = [region]
+        else:
+            current_group.append(region)
+
+        last_page_number = current_number
+
+    if current_group:
+        documents.append((current_group[0]['page'], current_group[-1]['page'],
+                          [r['current_page'] for r in current_group]))
+
+    return documents
+
+
+def group_by_filenames(custom_filenames):
+    """将连续且文件名相同的页面分为一组，返回 [(start, end, name), ...]"""
+    valid_filenames = {page_num: name for page_num, name in custom_filenames.items()
+                       if name and name != NO_CONTENT}
+    sorted_pages = sorted(valid_filenames)
+    if not sorted_pages:
+        return []
+
+    groups = []
+    start_page = sorted_pages[0]
+    current_name = valid_filenames[start_page]
+    for i in range(1, len(sorted_pages)):
+        page_num = sorted_pages[i]
+        name = valid_filenames[page_num]
+        # 文件名变化或者页面不连续时开始新的一组
+        if name != current_name or page_num != sorted_pages[i - 1] + 1:
+            groups.append((start_page, sorted_pages[i - 1], current_name))
+            start_page = page_num
+            current_name = name
+    groups.append((start_page, sorted_pages[-1], current_name))
+    return groups
+
+
+def plan_file_outputs(file_path, page_count, regions, custom_filenames, template_mode):
+    """生成单个文件的分割计划
+
+    返回 [{'filename': 输出文件名, 'pages': [page_index, ...]}, ...]
+    """
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    custom_filenames = custom_filenames or {}
+
+    # 没有页码信息但有自定义文件名时，按文件名分割
+    if (not regions or all(region.get('is_filename', False) for region in regions)) and custom_filenames:
+        groups = group_by_filenames(custom_filenames)
+        if groups:
+            return [{'filename': sanitize_filename(f"{name}.pdf"), 'pages': list(range(start, end + 1))}
+                    for start, end, name in groups]
+
+    # 只有一页且没有识别到任何内容时，复制整个文件
+    if page_count == 1 and (not regions or all(not region.get('text', '').strip() for region in regions)):
+        return [{'filename': f"{base_name}_完整文件.pdf", 'pages': [0]}]
+
+    def custom_name_for(page_index):
+        name = custom_filenames.get(page_index)
+        return name if name and name != NO_CONTENT else None
+
+    outputs = []
+    if template_mode == "double":
+        for i, (total_pages, pages) in enumerate(group_double_mode(regions), 1):
+            custom_name = custom_name_for(pages[0][0])
+            if custom_name:
+                output_filename = f"{custom_name}.pdf"
+            else:
+                output_filename = f"{base_name}_{i:02d}_第{pages[0][1]}至{pages[-1][1]}张共{total_pages}张.pdf"
+            outputs.append({'filename': output_filename, 'pages': [page_index for page_index, _ in pages]})
+    else:
+        for i, (start_page, end_page, page_numbers) in enumerate(group_single_mode(regions), 1):
+            custom_name = custom_name_for(start_page)
+            if custom_name:
+                output_filename = f"{custom_name}.pdf"
+            else:
+                output_filename = f"{base_name}_{i:02d}_第{page_numbers[0]}至{page_numbers[-1]}张.pdf"
+            outputs.append({'filename': output_filename, 'pages': list(range(start_page, end_page + 1))})
+    return outputs
+
+
+class ImageCache:
+    """已优化图像的缓存，按原图像内容的哈希查找
+
+    同一批处理中不同输出文件引用的相同图像（例如图框中的标志）只重新压缩一次。
+    值为优化后的图像数据，None表示优化后没有变小、保留原图像，b''表示不适合重新压缩。
+    缓存数据超过max_bytes时淘汰最久未使用的项。
+    """
+
+    def __init__(self, max_bytes=IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key):
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+        if key in self.items:
+            self.size -= len(self.items.pop(key) or b'')
+        self.items[key] = value
+        self.size += len(value or b'')
+        while self.size > self.max_bytes and len(self.items) > 1:
+            _, old_value = self.items.popitem(last=False)
+            self.size -= len(old_value or b'')
+
+
+# 进程内共用的图像缓存，多进程分割时每个工作进程各有一个
+_image_cache = ImageCache()
+
+
+class PixelBudget:
+    """限制多个线程同时解码的图像像素总数
+
+    超过上限的单个图像在没有其他图像解码时单独处理。
+    """
+
+    def __init__(self, max_pixels):
+        self.max_pixels = max_pixels
+        self.in_use = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, pixels):
+        with self.condition:
+            while self.in_use and self.in_use + pixels > self.max_pixels:
+                self.condition.wait()
+            self.in_use += pixels
+
+    def release(self, pixels):
+        with self.condition:
+            self.in_use -= pixels
+            self.condition.notify_all()
+
+
+def _recompress_image(image_bytes, image_ext, stored_size, target_size=None):
+    """重新压缩图像，返回压缩后的数据
+
+    参数:
+        target_size: 缩小到的像素尺寸 (宽, 高)，None表示保持原尺寸
+
+    没有比stored_size（PDF中原数据大小）更小时返回None，不适合重新压缩时返回b''
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.mode == "CMYK":
+        # CMYK的JPEG重新编码后颜色可能反转
+        return b''
+
+    # 二值和调色板图像缩小后线条模糊、数据反而变大，只重新编码
+    if target_size and img.mode not in ("1", "P"):
+        img.draft(img.mode, target_size)  # JPEG解码时直接按1/2、1/4、1/8缩小，减少内存占用
+        img = img.resize(target_size, Image.LANCZOS)
+
+    # 根据图像大小动态调整质量：越大的图像使用越低的质量
+    img_size = len(image_bytes) / 1024  # KB
+    if img_size > 1000:  # > 1MB
+        quality = 65
+    elif img_size > 500:  # > 500KB
+        quality = 75
+    elif img_size > 100:  # > 100KB
+        quality = 80
+    else:
+        quality = 85
+
+    output_buffer = io.BytesIO()
+    if image_ext.lower() in ("jpg", "jpeg"):
+        img.save(output_buffer, format="JPEG", quality=quality, optimize=True)
+    else:
+        img.save(output_buffer, format="PNG", optimize=True, compress_level=9)  # 最高压缩级别
+
+    compressed_bytes = output_buffer.getvalue()
+
+    # 只有新图像更小时才替换
+    return compressed_bytes if len(compressed_bytes) < stored_size else None
+
+
+def _target_image_size(width, height, transforms, target_dpi):
+    """按图像在页面上的摆放计算实际分辨率（有效DPI），高于target_dpi时返回缩小后的像素尺寸，否则返回None
+
+    参数:
+        transforms: 图像各处摆放的变换矩阵 (a, b, c, d, e, f)，把图像映射到页面上的位置（点）；
+                    各方向需要的像素数按其中最大的摆放计算
+    """
+    if not transforms:
+        # 找不到摆放位置（例如只在注释中使用）时不缩小
+        return None
+    placed_width = max(math.hypot(a, b) for a, b, c, d, e, f in transforms) / 72  # 英寸
+    placed_height = max(math.hypot(c, d) for a, b, c, d, e, f in transforms) / 72
+    target_size = (min(width, max(1, math.ceil(placed_width * target_dpi))),
+                   min(height, max(1, math.ceil(placed_height * target_dpi))))
+    return target_size if target_size != (width, height) else None
+
+
+IMAGE_DICT_KEYS = ("Width", "Height", "BitsPerComponent", "ColorSpace", "Decode")
+
+
+def _resolve_pdf_value(doc, value, depth=0):
+    """把PDF值中的间接引用替换为被引用对象的内容（流对象再加上其数据的SHA-1）
+
+    不同输出文档中同一对象的xref号不同，替换后相同内容的值在各文档中一致。
+    """
+    def resolve(match):
+        xref = int(match.group(1))
+        text = doc.xref_object(xref, compressed=True)
+        if doc.xref_is_stream(xref):
+            text += hashlib.sha1(doc.xref_stream_raw(xref)).hexdigest()
+        return "<" + (_resolve_pdf_value(doc, text, depth + 1) if depth < 3 else text) + ">"
+    return re.sub(r"(\d+) (\d+) R", resolve, value)
+
+
+def _image_dict_key(doc, xref):
+    """图像字典中影响解码结果的项（尺寸、位深、颜色空间含调色板、Decode），用于图像缓存的键"""
+    return json.dumps([_resolve_pdf_value(doc, doc.xref_get_key(xref, name)[1]) for name in IMAGE_DICT_KEYS])
+
+
+def _replace_image(page, xref, stream):
+    """用新的图像数据替换xref处的图像（同Page.replace_image），返回插入时临时生成的图像xref"""
+    doc = page.parent
+    new_xref = page.insert_image(page.rect, stream=stream)
+    doc.xref_copy(new_xref, xref)
+    # 插入图像时生成的绘制指令清空，页面仍按原来的位置绘制xref处的图像
+    doc.update_stream(page.get_contents()[-1], b" ")
+    return new_xref
+
+
+def _optimize_images(doc, image_cache, target_dpi=None, max_pixels=MAX_DECODED_PIXELS):
+    """重新压缩文档中的图像，多个页面引用的同一图像只处理一次
+
+    在当前线程中逐个提取需要处理的图像，由线程池重新压缩，压缩完成后在当前线程中替换回文档
+    （PyMuPDF不支持多线程访问）。同时解码的像素数和等待压缩的数据量都有上限，内存占用与文档中的图像总量无关。
+
+    返回 {xref: 结果}，结果为 "replaced"、"enlarged"（压缩后没有变小）或 "skipped"，
+    替换时生成的临时图像副本的结果为None
+    """
+    decisions = {}
+    images = {}  # xref -> (页面, 宽, 高)
+    placements = {}  # (宽, 高) -> 该尺寸的图像在各页面上摆放的变换矩阵
+    for page_num in range(len(doc)):
+        page = doc[page_num]
+        page_has_images = False
+        for img_info in page.get_images(full=True):
+            xref, smask, width, height = img_info[:4]  # 图像的xref号、透明蒙版、像素尺寸
+            if xref in decisions:
+                continue
+            if smask or doc.xref_get_key(xref, "ImageMask")[1] == "true":
+                # 带透明蒙版的图像替换后会丢失透明度
+                decisions[xref] = "skipped"
+                continue
+            page_has_images = True
+            if xref not in images:
+                images[xref] = (page, width, height)
+        if target_dpi and page_has_images:
+            # get_image_info不解码图像，但也不能直接对应xref（计算对应关系需要解码），
+            # 按像素尺寸对应：同尺寸的多个图像取其中最大的摆放，只会少缩小、不会缩得过小
+            for info in page.get_image_info():
+                placements.setdefault((info['width'], info['height']), []).append(info['transform'])
+
+    budget = PixelBudget(max_pixels)
+    waiting = {}  # 键 -> [xref, ...]，等待压缩结果的图像（内容相同的图像只压缩一次）
+
+    def recompress(image_bytes, image_ext, stored_size, target_size, pixels):
+        # 在线程池中运行，像素预算在提取图像前已经占用，压缩完成后释放
+        try:
+            return _recompress_image(image_bytes, image_ext, stored_size, target_size)
+        except Exception:
+            return b''  # 单个图像出错时保留原图像
+        finally:
+            budget.release(pixels)
+
+    def finish(key, compressed_bytes):
+        """把压缩结果写回文档中所有使用这个图像的xref（在当前线程中）"""
+        for xref in waiting.pop(key):
+            if compressed_bytes is None:
+                decisions[xref] = "enlarged"
+            elif not compressed_bytes:
+                decisions[xref] = "skipped"
+            else:
+                try:
+                    # 替换时生成的副本不再处理，也不计数
+                    decisions[_replace_image(images[xref][0], xref, compressed_bytes)] = None
+                    decisions[xref] = "replaced"
+                except Exception:
+                    decisions[xref] = "skipped"
+
+    # 逐个提取图像并提交给线程池，已提交但还没有压缩完的数据不超过MAX_PENDING_IMAGE_BYTES；
+    # 压缩完成的图像立即写回文档，不在内存中保留所有图像的原数据和压缩结果
+    executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS) if IMAGE_WORKERS > 1 and len(images) > 1 else None
+    futures = {}  # future -> (键, 原数据大小)
+    pending_bytes = 0
+
+    def collect(block):
+        nonlocal pending_bytes
+        if block:
+            completed, _ = wait(futures, return_when=FIRST_COMPLETED)
+        else:
+            completed = [future for future in futures if future.done()]
+        for future in completed:
+            key, nbytes = futures.pop(future)
+            pending_bytes -= nbytes
+            compressed_bytes = future.result()
+            image_cache.put(key, compressed_bytes)
+            finish(key, compressed_bytes)
+
+    try:
+        for xref, (page, width, height) in images.items():
+            try:
+                pixels = width * height
+                target_size = None
+                if target_dpi:
+                    target_size = _target_image_size(width, height, placements.get((width, height)), target_dpi)
+                # 以PDF中存储的原始数据和图像字典作为键：extract_image对非JPEG图像每次都会重新生成PNG；
+                # 数据相同而尺寸、颜色空间（调色板）或Decode不同的图像解码结果不同
+                raw_stream = doc.xref_stream_raw(xref)
+                stored_size = len(raw_stream)
+                digest = hashlib.sha1(raw_stream)
+                del raw_stream
+                digest.update(_image_dict_key(doc, xref).encode('utf-8'))
+                key = digest.hexdigest()
+                if target_size:
+                    key += "@%dx%d" % target_size
+                if key in waiting:
+                    waiting[key].append(xref)
+                    continue
+                if key in image_cache:
+                    waiting[key] = [xref]
+                    finish(key, image_cache.get(key))
+                    continue
+
+                # extract_image会解码非JPEG图像，提取前就占用像素预算
+                budget.acquire(pixels)
+                try:
+                    base_image = doc.extract_image(xref)
+                except Exception:
+                    budget.release(pixels)
+                    raise
+                # 仅处理像素图像格式（不处理矢量图像）
+                if not base_image or base_image["ext"].lower() not in ("jpg", "jpeg", "png"):
+                    budget.release(pixels)
+                    decisions[xref] = "skipped"
+                    continue
+
+                waiting[key] = [xref]
+                job = (base_image["image"], base_image["ext"], stored_size, target_size, pixels)
+                del base_image
+                if executor is None:
+                    compressed_bytes = recompress(*job)
+                    image_cache.put(key, compressed_bytes)
+                    finish(key, compressed_bytes)
+                    continue
+                while futures and pending_bytes + len(job[0]) > MAX_PENDING_IMAGE_BYTES:
+                    collect(block=True)
+                futures[executor.submit(recompress, *job)] = (key, len(job[0]))
+                pending_bytes += len(job[0])
+                del job
+                collect(block=False)
+            except Exception:
+                # 单个图像出错时继续处理其他图像
+                decisions[xref] = "skipped"
+        while futures:
+            collect(block=True)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return decisions
+
+
+def optimize_and_save_pdf(doc, output_path, profile=DEFAULT_OPTIMIZE_PROFILE, image_cache=None, image_stats=None,
+                          target_dpi=None, max_pixels=MAX_DECODED_PIXELS):
+    """优化PDF文件并保存
+
+    按优化方案（见OPTIMIZE_PROFILES）应用多种优化技术来减小PDF文件大小：
+    - 垃圾回收：移除未使用的对象
+    - 压缩：对PDF内容进行压缩
+    - 清理：移除冗余对象
+    - 优化图像：对图像应用压缩，相同内容的图像使用image_cache中的结果
+
+    参数:
+        profile: 优化方案名称
+        image_stats: 可选的计数字典，累加本文档中各图像的处理结果
+                     {"replaced": 替换, "enlarged": 压缩后没有变小, "skipped": 跳过}
+        target_dpi: 重新压缩图像时把分辨率高于此值的图像缩小到此分辨率，None表示不缩小
+        max_pixels: 同时解码的图像像素总数上限
+    """
+    settings = OPTIMIZE_PROFILES[profile]
+    if image_cache is None:
+        image_cache = _image_cache
+
+    try:
+        # 第一步：优化每一页中的图像（有损，仅部分方案）
+        decisions = {}
+        if settings['recompress_images']:
+            decisions = _optimize_images(doc, image_cache, target_dpi, max_pixels)
+
+        if image_stats is not None:
+            for outcome in decisions.values():
+                if outcome:
+                    image_stats[outcome] = image_stats.get(outcome, 0) + 1
+
+        # 第二步：使用PyMuPDF的内置优化功能保存PDF
+        doc.save(output_path, **settings['save'])
+        return True
+
+    except Exception as e:
+        print(f"优化PDF时出错: {str(e)}")
+        # 如果优化失败，使用基本设置保存
+        doc.save(output_path, garbage=4, deflate=True)
+        return False
+
+
+def page_runs(pages):
+    """将页码列表合并为连续的区间 [(from_page, to_page), ...]，保持页面顺序"""
+    runs = []
+    for page_index in pages:
+        if runs and page_index == runs[-1][1] + 1:
+            runs[-1][1] = page_index
+        else:
+            runs.append([page_index, page_index])
+    return [tuple(run) for run in runs]
+
+
+def insert_pages(output_doc, src_doc, pages):
+    """将源文档的指定页面按顺序插入output_doc
+
+    连续的页面只调用一次insert_pdf，同一个输出文档的所有插入共用一个对象映射，
+    共享的字体、图像等资源只复制一次。
+    """
+    for from_page, to_page in page_runs(pages):
+        output_doc.insert_pdf(src_doc, from_page=from_page, to_page=to_page)
+
+
+def write_output(src_doc, pages, output_path, image_stats=None, profile=DEFAULT_OPTIMIZE_PROFILE,
+                 target_dpi=None, max_pixels=MAX_DECODED_PIXELS):
+    """将源文档的指定页面写入新的PDF文件，优化参数见optimize_and_save_pdf"""
+    output_doc = fitz.open()
+    try:
+        insert_pages(output_doc, src_doc, pages)
+        optimize_and_save_pdf(output_doc, output_path, profile, image_stats=image_stats,
+                              target_dpi=target_dpi, max_pixels=max_pixels)
+    finally:
+        output_doc.close()
+
+
+def write_outputs(file_path, outputs, output_dir, on_output=None, image_stats=None,
+                  profile=DEFAULT_OPTIMIZE_PROFILE, target_dpi=None, max_pixels=MAX_DECODED_PIXELS,
+                  cancel_event=None):
+    """打开源文件，生成一组计划中的输出文件（也在工作进程中运行）
+
+    参数:
+        on_output: 每生成一个文件后调用 on_output(output)
+        image_stats: 累加图像优化结果的计数字典，见optimize_and_save_pdf
+        profile: 优化方案名称，见OPTIMIZE_PROFILES
+        target_dpi, max_pixels: 图像缩小的分辨率和同时解码的像素上限，见optimize_and_save_pdf
+        cancel_event: 设置后不再生成后面的文件
+
+    返回生成的文件路径列表，顺序同outputs
+    """
+    output_paths = []
+    with fitz.open(file_path) as src_doc:
+        for output in outputs:
+            if cancel_event and cancel_event.is_set():
+                break
+            output_path = os.path.join(output_dir, output['filename'])
+            write_output(src_doc, output['pages'], output_path, image_stats, profile, target_dpi, max_pixels)
+            output_paths.append(output_path)
+            if on_output:
+                on_output(output)
+    return output_paths
+
+
+def _write_outputs_unit(file_path, outputs, output_dir, profile, target_dpi, max_pixels):
+    """工作进程中生成一组输出文件
+
+    返回 (图像优化结果的计数, 已生成的文件数, 异常)；出错时不抛出异常，
+    以便主进程记录出错前已经生成的文件，没有出错时异常为None。
+    """
+    image_stats = {}
+    written = []
+    try:
+        write_outputs(file_path, outputs, output_dir, written.append, image_stats, profile, target_dpi, max_pixels)
+    except Exception as e:
+        return image_stats, len(written), e
+    return image_stats, len(written), None
+
+
+def merge_image_stats(image_stats, other):
+    """把other中的图像优化计数累加到image_stats"""
+    for outcome, count in other.items():
+        image_stats[outcome] = image_stats.get(outcome, 0) + count
+
+
+def format_image_stats(image_stats):
+    """图像优化计数的说明文字"""
+    return (f"图像优化: 替换 {image_stats.get('replaced', 0)} 个, "
+            f"压缩后未变小 {image_stats.get('enlarged', 0)} 个, 跳过 {image_stats.get('skipped', 0)} 个")
+
+
+class SplitJournal:
+    """分割任务日志：记录已经生成的输出文件及其大小和校验和
+
+    日志保存在输出目录中（SPLIT_JOURNAL_NAME），每生成一个文件追加一行JSON，
+    程序中途崩溃时已写入的记录不会丢失。再次分割到同一目录时，输入（源文件内容、页面、
+    优化方案和分辨率）没有变化、且文件大小和校验和与记录一致的输出文件直接跳过，
+    从上次中断的地方继续。
+    """
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, SPLIT_JOURNAL_NAME)
+        self.entries = {}  # {normcase(文件名): 记录}
+        self.skipped = 0  # 本次跳过的输出文件数
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as f:
+                data = f.read()
+                if data and not data.endswith(b"\n"):
+                    # 崩溃时没有写完的最后一行：截掉，否则下一条记录会接在这一行后面而一起失效
+                    f.truncate(data.rfind(b"\n") + 1)
+            for line in data.decode('utf-8', errors='replace').splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 崩溃时没有写完的行
+                self.entries[os.path.normcase(entry['filename'])] = entry
+
+    @staticmethod
+    def output_key(file_path, output, profile, target_dpi):
+        """输出文件的输入指纹：源文件内容、页面和影响输出内容的优化参数"""
+        data = [file_index.file_hash(file_path), output['pages'], profile, target_dpi]
+        return hashlib.sha1(json.dumps(data).encode('utf-8')).hexdigest()
+
+    def is_complete(self, output_dir, output, key):
+        """输出文件是否已经按相同的输入生成，且文件没有被修改"""
+        entry = self.entries.get(os.path.normcase(output['filename']))
+        if not entry or entry['key'] != key:
+            return False
+        output_path = os.path.join(output_dir, output['filename'])
+        try:
+            if os.path.getsize(output_path) != entry['size']:
+                return False
+        except OSError:
+            return False
+        return file_content_hash(output_path) == entry['sha1']
+
+    def record(self, output_dir, output, key):
+        """记录刚生成的输出文件"""
+        output_path = os.path.join(output_dir, output['filename'])
+        entry = {'filename': output['filename'], 'key': key, 'size': os.path.getsize(output_path),
+                 'sha1': file_content_hash(output_path)}
+        self.entries[os.path.normcase(output['filename'])] = entry
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def split_files(jobs, output_dir, template_mode, progress=None, workers=None, image_stats=None,
+                profile=DEFAULT_OPTIMIZE_PROFILE, target_dpi=None, max_pixels=MAX_DECODED_PIXELS,
+                journal=None, cancel_event=None, errors=None):
+    """按识别结果分割多个PDF文件
+
+    先为所有文件生成分割计划，再把输出文件分成若干工作单元，由多个进程同时生成，
+    每个进程单独打开源文件。输出文件较少或只有一个CPU时在当前进程中顺序生成。
+
+    参数:
+        jobs: [(file_path, regions, custom_filenames), ...]
+        progress: 进度回调 progress(done, total, filename)，done和total为输出文件数
+        workers: 进程数，默认使用CPU核数
+        image_stats: 可选的计数字典，累加所有输出文件的图像优化结果（每个输出文件中的图像各计一次）
+        profile: 输出文件的优化方案名称，见OPTIMIZE_PROFILES
+        target_dpi: 重新压缩图像时缩小到的分辨率，None表示不缩小
+        max_pixels: 同时解码的图像像素总数上限，多进程时由各进程平分
+        journal: 可选的SplitJournal，跳过日志中已完成的输出文件，并记录新生成的文件
+        cancel_event: 可选的threading.Event，设置后不再开始新的输出文件（已开始的工作单元会完成，
+            多进程时进度和取消以工作单元为单位，每个单元最多MAX_UNIT_OUTPUTS个文件）
+        errors: 可选的字典，收集出错的文件 {file_path: 异常}。一个文件出错时继续处理其他文件，
+            已生成的文件都会记录在任务日志中；不给出时全部处理完后抛出第一个异常
+
+    返回 {file_path: [生成的文件路径, ...]}（包括跳过的已有文件，出错的文件也列出计划生成的所有文件）
+    """
+    failed = {}
+    plans = []
+    for file_path, regions, custom_filenames in jobs:
+        try:
+            plans.append((file_path, plan_file_outputs(file_path, get_page_count(file_path), regions,
+                                                       custom_filenames, template_mode)))
+        except Exception as e:
+            failed[file_path] = e
+    results = {file_path: [] for file_path in failed}
+    results.update((file_path, [os.path.join(output_dir, output['filename']) for output in outputs])
+                   for file_path, outputs in plans)
+
+    # 同名的输出文件只生成最后一个（与顺序生成时后面的覆盖前面的结果相同），
+    # 避免多个进程同时写同一个文件
+    final_outputs = {}
+    for file_path, outputs in plans:
+        for output in outputs:
+            final_outputs[os.path.normcase(output['filename'])] = (file_path, output)
+    total = len(final_outputs)
+    done = 0
+    keys = {}
+    pending = {}
+    for file_path, output in final_outputs.values():
+        if journal:
+            if cancel_event and cancel_event.is_set():
+                return _split_results(results, failed, errors)
+            key = keys[id(output)] = journal.output_key(file_path, output, profile, target_dpi)
+            if journal.is_complete(output_dir, output, key):
+                journal.skipped += 1
+                done += 1
+                # 检查已有文件（计算校验和）也更新进度，界面在回调中处理事件（包括取消）
+                if progress:
+                    progress(done, total, output['filename'])
+                continue
+        pending.setdefault(file_path, []).append(output)
+
+    def finished(output):
+        if journal:
+            journal.record(output_dir, output, keys[id(output)])
+
+    workers = workers or os.cpu_count() or 1
+    pending_count = sum(len(outputs) for outputs in pending.values())
+
+    if workers <= 1 or pending_count < PARALLEL_MIN_OUTPUTS:
+        def on_output(output):
+            nonlocal done
+            finished(output)
+            done += 1
+            if progress:
+                progress(done, total, output['filename'])
+
+        for file_path, outputs in pending.items():
+            if cancel_event and cancel_event.is_set():
+                break
+            try:
+                write_outputs(file_path, outputs, output_dir, on_output, image_stats, profile, target_dpi,
+                              max_pixels, cancel_event)
+            except Exception as e:
+                failed[file_path] = e
+        return _split_results(results, failed, errors)
+
+    # 每个工作进程大约分到4个单元，以便负载均衡；单元不超过MAX_UNIT_OUTPUTS个文件，取消时不必等待太久
+    batch_size = min(MAX_UNIT_OUTPUTS, max(1, -(-pending_count // (workers * 4))))
+    units = []
+    for file_path, outputs in pending.items():
+        for i in range(0, len(outputs), batch_size):
+            units.append((file_path, outputs[i:i + batch_size]))
+
+    workers = min(workers, len(units))
+    unit_max_pixels = max(1, max_pixels // workers)
+    units.reverse()
+    futures = {}
+
+    def submit_next():
+        if units and not (cancel_event and cancel_event.is_set()):
+            file_path, outputs = units.pop()
+            futures[executor.submit(_write_outputs_unit, file_path, outputs, output_dir, profile,
+                                    target_dpi, unit_max_pixels)] = (file_path, outputs)
+
+    # 每个进程同时只分配一个工作单元，一个完成后再提交下一个，取消时只需等待正在运行的单元
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for _ in range(workers):
+            submit_next()
+        while futures:
+            completed, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in completed:
+                file_path, outputs = futures.pop(future)
+                try:
+                    unit_stats, written, error = future.result()
+                except Exception as e:  # 工作进程异常退出等
+                    unit_stats, written, error = {}, 0, e
+                submit_next()
+                if image_stats is not None:
+                    merge_image_stats(image_stats, unit_stats)
+                for output in outputs[:written]:
+                    finished(output)
+                if error is not None:
+                    failed.setdefault(file_path, error)
+                # 出错的单元中没有生成的文件也计入进度，使进度能到达100%
+                done += len(outputs)
+                if progress:
+                    progress(done, total, outputs[-1]['filename'])
+    finally:
+        executor.shutdown(cancel_futures=True)
+    return _split_results(results, failed, errors)
+
+
+def _split_results(results, failed, errors):
+    """返回split_files的结果：出错的文件放入errors，没有给出errors时抛出第一个异常"""
+    if errors is not None:
+        errors.update(failed)
+    elif failed:
+        raise next(iter(failed.values()))
+    return results
+
+
+def split_file(file_path, output_dir, regions, custom_filenames, template_mode, progress=None, workers=None,
+               image_stats=None, profile=DEFAULT_OPTIMIZE_PROFILE, target_dpi=None, max_pixels=MAX_DECODED_PIXELS,
+               journal=None, cancel_event=None):
+    """按识别结果分割单个PDF文件，参数见split_files
+
+    返回生成的文件路径列表
+    """
+    return split_files([(file_path, regions, custom_filenames)], output_dir, template_mode,
+                       progress, workers, image_stats, profile, target_dpi, max_pixels,
+                       journal, cancel_event)[file_path]
+
+
+TEMPLATE_FILE_VERSION = 1
+
+
+def save_templates(path, templates):
+    """保存模板文件
+
+    templates格式: {'default': template, 'sizes': {size_key: template}}
+    """
+    data = {
+        'version': TEMPLATE_FILE_VERSION,
+        'default': templates.get('default'),
+        'sizes': templates.get('sizes', {}),
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def load_templates(path):
+    """读取模板文件，格式见save_templates"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    if data.get('version') != TEMPLATE_FILE_VERSION:
+        raise ValueError(f"不支持的模板文件版本: {data.get('version')}")
+
+    def parse(template):
+        if not template:
+            return None
+        return make_template(template.get('mode'), template.get('page_rect'),
+                             template.get('total_rect'), template.get('filename_rects'))
+
+    return {
+        'default': parse(data.get('default')),
+        'sizes': {size_key: parse(template) for size_key, template in data.get('sizes', {}).items()},
+    }
+
+
+def default_cache_path():
+    """识别结果缓存文件的默认位置"""
+    return os.path.join(os.path.expanduser("~"), ".pdf_splitter", "recognition_cache.db")
+
+
+def file_content_hash(file_path):
+    """计算文件内容的SHA-1"""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def region_fingerprint(region, line_tolerance=DEFAULT_LINE_TOLERANCE):
+    """返回区域的指纹，区域类型和坐标（文本区域还有行容差）相同时指纹相同"""
+    kind, rect = region
+    data = [RECOGNITION_CACHE_VERSION, kind, [round(v, 2) for v in rect]]
+    if kind == "text":
+        data.append(round(line_tolerance, 2))
+    return hashlib.sha1(json.dumps(data).encode('utf-8')).hexdigest()
+
+
+class RecognitionCache:
+    """保存在磁盘上的识别结果缓存（SQLite）
+
+    按 文件内容哈希 + 区域指纹 保存每一页上每个区域的识别值，
+    重新添加文件、重启程序或重复批处理时，输入没有变化的页面不再重新识别；
+    修改模板时只有变化的区域需要重新识别。path为":memory:"时只在内存中缓存。
+    可以在后台识别线程中使用，各操作之间加锁。
+    """
+
+    def __init__(self, path=None):
+        path = path or default_cache_path()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                file_hash TEXT, fingerprint TEXT, page INTEGER, value TEXT,
+                PRIMARY KEY (file_hash, fingerprint, page)
+            );
+        """)
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def file_hash(self, file_path):
+        """返回文件内容的哈希，文件大小和修改时间没有变化时使用上次计算的结果"""
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime_ns, hash FROM files WHERE path = ?",
+                                    (file_path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        file_hash = file_content_hash(file_path)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                              (file_path, stat.st_size, stat.st_mtime_ns, file_hash))
+            self.conn.commit()
+        return file_hash
+
+    def load(self, file_hash, region, line_tolerance=DEFAULT_LINE_TOLERANCE):
+        """返回区域已缓存的识别值 {page_num: value}"""
+        with self.lock:
+            rows = self.conn.execute("SELECT page, value FROM results WHERE file_hash = ? AND fingerprint = ?",
+                                     (file_hash, region_fingerprint(region, line_tolerance))).fetchall()
+        return {page_num: json.loads(value) for page_num, value in rows}
+
+    def store(self, file_hash, region, values, line_tolerance=DEFAULT_LINE_TOLERANCE):
+        """保存区域的识别值 {page_num: value}"""
+        fingerprint = region_fingerprint(region, line_tolerance)
+        rows = [(file_hash, fingerprint, page_num, json.dumps(value)) for page_num, value in values.items()]
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+
+def template_for_size(templates, size_key):
+    """返回指定图幅使用的模板
+
+    图幅模板中未设置的页码或文件名区域使用默认模板的设置。
+    """
+    default = templates.get('default') or make_template()
+    size_template = templates.get('sizes', {}).get(size_key)
+    if not size_template:
+        return default
+
+    page_source = size_template if size_template.get('page_rect') else default
+    filename_source = size_template if size_template.get('filename_rects') else default
+    return make_template(page_source['mode'], page_source['page_rect'], page_source['total_rect'],
+                         filename_source['filename_rects'])
+
+
+def templates_mode(templates):
+    """返回模板集合使用的页码模式（默认模板优先）"""
+    candidates = [templates.get('default')] + list(templates.get('sizes', {}).values())
+    for template in candidates:
+        if template and template.get('mode'):
+            return template['mode']
+    return None
+
+
+def recognize_file(file_path, templates, progress=None, line_tolerance=DEFAULT_LINE_TOLERANCE, cache=None):
+    """按图幅选择模板识别整个文件的页码和文件名
+
+    参数:
+        cache: RecognitionCache，已缓存的区域不再重新识别；None表示不使用缓存
+
+    返回 (page_numbers, filenames)：
+        page_numbers: {page_num: {'current_page', 'total_pages'}}，只包含识别成功的页面
+        filenames: {page_num: filename}，未识别到文本的页面值为空字符串，没有设置文件名区域的页面不包含在内
+    """
+    page_numbers = {}
+    filenames = {}
+    file_hash = file_index.file_hash(file_path, cache) if cache else None
+    # 按图幅分组，同一图幅的页面使用同一个模板
+    pages_by_size = file_index.page_sizes(file_path)
+    page_count = file_index.page_count(file_path)
+    pdf_doc = None  # 所有区域都已缓存时不需要打开文件
+    try:
+        done = 0
+        for size_key, pages in pages_by_size.items():
+            template = template_for_size(templates, size_key)
+            regions = template_regions(template)
+            known, pending = _plan_region_scan(cache, file_hash, regions, pages, line_tolerance)
+            done += len(pages) - sum(len(page_nums) for page_nums in pending.values())
+
+            for indexes, page_nums in pending.items():
+                if pdf_doc is None:
+                    pdf_doc = fitz.open(file_path)
+                new_values = {i: {} for i in indexes}
+                for page_num in page_nums:
+                    page_text = PageText(pdf_doc[page_num])
+                    for i in indexes:
+                        new_values[i][page_num] = evaluate_region(page_text, regions[i], line_tolerance)
+                    done += 1
+                    if progress:
+                        progress(done, page_count)
+                for i, values in new_values.items():
+                    known[i].update(values)
+                    if cache:
+                        cache.store(file_hash, regions[i], values, line_tolerance)
+
+            for page_num in pages:
+                page_number, filename = combine_region_values(
+                    template, [values[page_num] for values in known], page_count)
+                if page_number:
+                    page_numbers[page_num] = page_number
+                if filename is not None:
+                    filenames[page_num] = filename
+    finally:
+        if pdf_doc is not None:
+            pdf_doc.close()
+
+    if progress:
+        progress(page_count, page_count)
+    return page_numbers, filenames
+
+
+def recognize_files(files, templates, cache=None, workers=None, line_tolerance=DEFAULT_LINE_TOLERANCE, errors=None):
+    """按图幅选择模板识别多个文件，结果同recognize_file
+
+    所有文件中使用同一模板的页面合在一起，由iter_scan_cached分成工作单元多进程识别，
+    页数较少的文件也能同时处理。
+
+    参数:
+        cache: RecognitionCache，已缓存的区域不再重新识别；None表示不使用缓存
+        workers: 进程数，默认使用CPU核数
+        errors: 可选的字典，收集出错的文件 {file_path: 异常}，不给出时抛出第一个异常
+
+    返回 {file_path: (page_numbers, filenames)}，不包括出错的文件
+    """
+    failed = {}
+    results = {}
+    groups = {}  # {模板: (template, [(file_path, pages), ...])}
+    for file_path in files:
+        try:
+            pages_by_size = file_index.page_sizes(file_path)
+        except Exception as e:
+            failed[file_path] = e
+            continue
+        results[file_path] = ({}, {})
+        for size_key, pages in pages_by_size.items():
+            template = template_for_size(templates, size_key)
+            group = groups.setdefault(json.dumps(template, sort_keys=True), (template, []))
+            group[1].append((file_path, pages))
+
+    for template, pages_by_file in groups.values():
+        if not template_regions(template):
+            continue
+        scan_errors = {}
+        for file_path, _, page_results in iter_scan_cached(pages_by_file, template, cache, workers,
+                                                           line_tolerance, errors=scan_errors):
+            page_numbers, filenames = results[file_path]
+            for page_num, (page_number, filename) in page_results.items():
+                if page_number:
+                    page_numbers[page_num] = page_number
+                if filename is not None:
+                    filenames[page_num] = filename
+        # 只有出错的文件在当前进程中单独重新识别一次（已识别的区域使用缓存），其他文件保留进程池的结果
+        for file_path in scan_errors:
+            if file_path in failed:
+                continue
+            try:
+                results[file_path] = recognize_file(file_path, templates, line_tolerance=line_tolerance, cache=cache)
+            except Exception as e:
+                failed[file_path] = e
+
+    for file_path in failed:
+        results.pop(file_path, None)
+    if errors is not None:
+        errors.update(failed)
+    elif failed:
+        raise next(iter(failed.values()))
+    return results
+
+
+class Region:
+    """页面上的一个区域（页码/文件名识别结果或手动框选的区域）
+
+    只保存页码、总张数、文件名和坐标，显示用的文字由这些字段生成。
+    可以像原来的区域字典一样用 region['page']、region.get('is_filename')、'current_page' in region 读取。
+    """
+    __slots__ = ('page', 'rect', 'all_coords', 'current_page', 'total_pages', 'filename', 'is_filename',
+                 'manual', '_text')
+
+    KEYS = ('page', 'rect', 'all_coords', 'text', 'has_text', 'current_page', 'total_pages', 'page_text',
+            'is_filename', 'filename', 'filename_text', 'manual')
+
+    def __init__(self, page, rect=None, text=None, current_page=None, total_pages=None, filename=None,
+                 all_coords=None, manual=False):
+        self.page = page
+        self.rect = rect
+        self.all_coords = all_coords
+        self.current_page = current_page
+        self.total_pages = total_pages
+        self.filename = filename
+        self.is_filename = filename is not None
+        self.manual = manual
+        self._text = text
+
+    @property
+    def page_text(self):
+        if self.current_page is None:
+            return None
+        return f"第 {self.current_page} 张 共 {self.total_pages} 张"
+
+    @property
+    def filename_text(self):
+        return f"文件名: {self.filename}" if self.is_filename else None
+
+    @property
+    def text(self):
+        if self._text is not None:
+            return self._text
+        if self.current_page is not None and self.is_filename:
+            return f"{self.page_text} | {self.filename}"
+        return self.page_text or self.filename_text or ""
+
+    @text.setter
+    def text(self, value):
+        """设置显示的文字（手动框选或编辑过的区域），设为None时恢复为由识别结果生成"""
+        self._text = value
+
+    @property
+    def has_text(self):
+        return bool(self.text.strip())
+
+    def set_page_number(self, current_page, total_pages):
+        self.current_page = current_page
+        self.total_pages = total_pages
+        self._text = None
+
+    def clear_page_number(self):
+        self.current_page = None
+        self.total_pages = None
+        self._text = None
+
+    def set_filename(self, filename, all_coords=None):
+        self.filename = filename
+        self.is_filename = True
+        if all_coords is not None:
+            self.all_coords = all_coords
+        self._text = None
+
+    def get(self, key, default=None):
+        value = getattr(self, key) if key in self.KEYS else None
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        value = self.get(key)
+        return value is not None and value is not False
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class RegionStore:
+    """一个文件的所有区域，按页码索引
+
+    每页第一个区域（页码和文件名识别结果都写在这个区域上）保存在按页码下标的数组中，
+    查找、更新和删除都是O(1)；同一页上再手动框选的区域数量很少，单独保存在列表中。
+    遍历时按页码顺序返回。
+    """
+    __slots__ = ('pages', 'extra', 'count')
+
+    def __init__(self, regions=()):
+        self.pages = []
+        self.extra = []
+        self.count = 0
+        for region in regions:
+            self.add(region)
+
+    def get(self, page_num):
+        """指定页面的第一个区域，不存在时返回None"""
+        return self.pages[page_num] if page_num < len(self.pages) else None
+
+    def on_page(self, page_num):
+        """指定页面上的所有区域"""
+        region = self.get(page_num)
+        if region is None:
+            return []
+        return [region] + [r for r in self.extra if r.page == page_num]
+
+    def add(self, region):
+        page_num = region.page
+        if page_num >= len(self.pages):
+            self.pages.extend([None] * (page_num + 1 - len(self.pages)))
+        if self.pages[page_num] is None:
+            self.pages[page_num] = region
+        else:
+            self.extra.append(region)
+        self.count += 1
+
+    def remove(self, region):
+        page_num = region.page
+        if self.get(page_num) is region:
+            # 同一页还有其他区域时，把第一个移到数组中
+            for i, other in enumerate(self.extra):
+                if other.page == page_num:
+                    self.pages[page_num] = self.extra.pop(i)
+                    break
+            else:
+                self.pages[page_num] = None
+        else:
+            for i, other in enumerate(self.extra):
+                if other is region:
+                    del self.extra[i]
+                    break
+            else:
+                return
+        self.count -= 1
+
+    def clear_page_numbers(self, page_nums):
+        """清除指定页面的页码识别结果，保留文件名区域，删除这些页面上的其他区域"""
+        page_nums = set(page_nums)
+        for region in [r for page_num in page_nums for r in self.on_page(page_num)]:
+            if region.is_filename:
+                region.clear_page_number()
+            else:
+                self.remove(region)
+
+    def __iter__(self):
+        if not self.extra:
+            return (region for region in self.pages if region is not None)
+        return iter(sorted(self._iter_all(), key=lambda region: region.page))
+
+    def _iter_all(self):
+        for region in self.pages:
+            if region is not None:
+                yield region
+        yield from self.extra
+
+    def __len__(self):
+        return self.count
+
+
+def build_regions(page_numbers, filenames):
+    """将识别结果转换为分割使用的区域（RegionStore）和自定义文件名字典"""
+    regions = RegionStore()
+    for page_num in sorted(set(page_numbers) | set(filenames)):
+        region = Region(page_num)
+        result = page_numbers.get(page_num)
+        if result:
+            region.set_page_number(result['current_page'], result['total_pages'])
+        if page_num in filenames:
+            region.set_filename(filenames[page_num] or NO_CONTENT)
+        regions.add(region)
+
+    custom_filenames = {page_num: filename for page_num, filename in filenames.items() if filename}
+    return regions, custom_filenames
@@ -1,11 +1,92 @@
 import os
-import re
 import json
+import math
+import queue
+import threading
+import multiprocessing
+from collections import OrderedDict
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, Canvas, Scrollbar, Frame
 import fitz  # PyMuPDF
 from PIL import Image, ImageTk
-import io
+from pdf_splitter_engine import (
+    NO_CONTENT, DEFAULT_LINE_TOLERANCE, canvas_to_pdf_rect, make_template, get_page_count, detect_page_sizes,
+    extract_number_from_text, extract_text_from_rect, iter_scan_cached, PageTextCache, RecognitionCache,
+    split_files, save_templates, format_image_stats, OPTIMIZE_PROFILES, DEFAULT_OPTIMIZE_PROFILE, file_index,
+    Region, RegionStore, SplitJournal,
+)
+
+# 图像分辨率的选项，第一项表示不缩小
+TARGET_DPI_CHOICES = ["原分辨率", "300 dpi", "200 dpi", "150 dpi", "100 dpi"]
+
+# 区域列表中一个节点下最多直接显示的区域行数，更多的区域按页码范围分组
+REGION_LIST_CHUNK = 200
+
+# 后台识别时主线程取出识别结果、刷新进度的间隔（毫秒）
+SCAN_POLL_MS = 100
+
+# 已渲染页面图像缓存的最大容量（字节，按每像素4字节估算）
+PAGE_IMAGE_CACHE_BYTES = 256 * 1024 * 1024
+
+# 页面按此大小（像素）分块渲染，只渲染窗口中可见的块，滚动时再渲染新出现的块
+TILE_SIZE = 1024
+
+# 保留显示列表的页数，同一页的各个块共用一个显示列表，页面内容只解析一次
+DISPLAY_LIST_PAGES = 4
+
+# 显示页面后预先渲染的前后页数，以及开始预渲染前等待的时间（毫秒，连续翻页时不预渲染）
+PREFETCH_PAGES = 1
+PREFETCH_DELAY_MS = 150
+
+# 页面低分辨率预览图的最大边长（像素）和保留的页数；缩放或翻到没有缓存的位置时，
+# 先显示由预览图放大的模糊图像，再逐块渲染清晰的图像替换
+PREVIEW_SIZE = 1200
+PREVIEW_PAGES = 8
+
+# 逐块渲染清晰图像的间隔（毫秒），保证每块之间先重绘画布并处理用户操作
+SHARP_RENDER_DELAY_MS = 10
+
+
+class PageImageCache:
+    """已渲染页面块（PhotoImage）的缓存，键为 (文件路径, 页码, 缩放比例, 列, 行)
+
+    翻页、缩放回到之前的比例或修改区域后重新显示时直接使用缓存的图像，不再重新渲染和转换。
+    值为 (图像, 图像在画布上的左上角坐标)。图像占用的内存按像素数估算，
+    超过max_bytes时淘汰最久未显示的块。
+    """
+
+    def __init__(self, max_bytes=PAGE_IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = OrderedDict()  # {key: (image, origin, nbytes)}
+
+    @staticmethod
+    def image_bytes(width, height):
+        return width * height * 4
+
+    def get(self, key):
+        """返回 (image, origin)，不存在时返回None"""
+        item = self.items.get(key)
+        if item is None:
+            return None
+        self.items.move_to_end(key)
+        return item[:2]
+
+    def put(self, key, image, origin):
+        if key in self.items:
+            self.size -= self.items.pop(key)[2]
+        nbytes = self.image_bytes(image.width(), image.height())
+        self.items[key] = (image, origin, nbytes)
+        self.size += nbytes
+        while self.size > self.max_bytes and len(self.items) > 1:
+            _, (_, _, old_bytes) = self.items.popitem(last=False)
+            self.size -= old_bytes
+
+    def forget(self, file_path):
+        """删除文件的所有页面图像"""
+        for key in [key for key in self.items if key[0] == file_path]:
+            self.size -= self.items.pop(key)[2]
+
 
 class PDFSplitterApp:
     def __init__(self, root):
@@ -17,6 +98,18 @@ class PDFSplitterApp:
         self.center_window(self.root, 1200, 800)
         
         self.pdf_document = None
+        self.page_text_cache = None  # 当前文件的页面文字缓存，框选提取文本时使用
+        self.page_image_cache = PageImageCache()  # 已渲染的页面块
+        self.display_lists = OrderedDict()  # 最近显示页面的显示列表 {(file_path, page_num): DisplayList}
+        self.page_view = None  # 当前显示的 (页码, 缩放比例, 宽, 高)
+        self.tile_images = {}  # 画布上已显示的块 {(列, 行): PhotoImage}，保持引用以免图像被回收
+        self.tile_items = {}  # 画布上块的图像项 {(列, 行): item id}
+        self.page_previews = OrderedDict()  # 最近显示页面的预览图 {(file_path, page_num): (PIL Image, 缩放比例)}
+        self.pending_tiles = []  # 还显示着模糊图像、等待渲染清晰图像的块
+        self.render_job = None  # 等待执行的清晰图像渲染（root.after的id）
+        self.tiles_job = None  # 等待执行的可见块渲染（root.after_idle的id）
+        self.prefetch_job = None  # 等待执行的预渲染（root.after的id）
+        self.prefetch_pages = []  # 还需要预渲染的页面
         self.current_page = 0
         self.scale_factor = 1.0
         self.pdf_path = None
@@ -36,7 +129,7 @@ class PDFSplitterApp:
         self.start_x = None
         self.start_y = None
         self.rect_id = None
-        self.selected_regions = {}  # 修改为字典，key为文件路径，value为区域列表
+        self.selected_regions = {}  # 修改为字典，key为文件路径，value为按页码索引的区域（RegionStore）
         self.current_region_text = ""
         
         # 新增：两步选择模式的变量
@@ -45,12 +138,24 @@ class PDFSplitterApp:
         self.total_pages_coords = None   # 存储"共m张"的坐标
         self.template_coords_set = False  # 标记是否已设置模板坐标
         self.template_mode = None  # 记录当前模板模式
+        self.replace_target = None  # 正在重新框选的单个模板区域，见start_region_replacement
         
         # 添加文件名模板相关变量
         self.filename_template_coords = []  # 变更为列表，存储多个区域
         self.filename_template_mode = False
         self.custom_filenames = {}  # 存储自定义文件名 {file_path: {page_num: filename}}
         self.template_region_count = 0  # 记录已选择的区域数量
+        self.scan_cancel_event = None  # 正在进行的后台识别的取消事件，同时只进行一次识别
+        # 已经识别过页码的页面 {file_path: (页码模板, set(page_nums))}，切换文件时只识别其余页面
+        self.scanned_pages = {}
+        
+        # 识别结果缓存：重新添加文件或重启程序后，未变化的文件不再重新识别；
+        # 修改模板区域后只重新识别变化的区域
+        try:
+            self.recognition_cache = RecognitionCache()
+        except Exception as e:
+            print(f"无法打开识别结果缓存，改为只在内存中缓存: {e}")
+            self.recognition_cache = RecognitionCache(":memory:")
         
         self.create_widgets()
     
@@ -64,6 +169,18 @@ class PDFSplitterApp:
         self.split_button = ttk.Button(control_frame, text="分割PDF", command=self.split_pdf, state=tk.DISABLED)
         self.split_button.pack(side=tk.LEFT, padx=5)
         
+        # 输出文件优化方案：在分割速度和文件大小之间取舍
+        ttk.Label(control_frame, text="输出优化:").pack(side=tk.LEFT)
+        self.profile_var = tk.StringVar(value=OPTIMIZE_PROFILES[DEFAULT_OPTIMIZE_PROFILE]['label'])
+        ttk.Combobox(control_frame, textvariable=self.profile_var, state="readonly", width=8,
+                     values=[profile['label'] for profile in OPTIMIZE_PROFILES.values()]).pack(side=tk.LEFT, padx=5)
+        
+        # 扫描图纸的图像缩小到的分辨率（仅在重新压缩图像的方案中有效）
+        ttk.Label(control_frame, text="图像分辨率:").pack(side=tk.LEFT)
+        self.target_dpi_var = tk.StringVar(value=TARGET_DPI_CHOICES[0])
+        ttk.Combobox(control_frame, textvariable=self.target_dpi_var, state="readonly", width=8,
+                     values=TARGET_DPI_CHOICES).pack(side=tk.LEFT, padx=5)
+        
         # 添加识别图幅按钮
         self.detect_size_button = ttk.Button(control_frame, text="识别图幅尺寸", 
                                            command=self.detect_page_sizes)
@@ -83,6 +200,15 @@ class PDFSplitterApp:
                                          command=lambda: self.start_template_selection(mode="single"))
         self.template_button2.pack(side=tk.LEFT, padx=5)
         
+        # 只重新框选一个模板区域，其他区域保持不变
+        ttk.Button(control_frame, text="修改单个区域", command=self.start_region_replacement).pack(side=tk.LEFT, padx=5)
+        
+        # 同时重新识别页码和文件名
+        ttk.Button(control_frame, text="重新识别", command=self.rescan_all_templates).pack(side=tk.LEFT, padx=5)
+        
+        # 保存模板供命令行批处理使用
+        ttk.Button(control_frame, text="保存模板", command=self.save_template_file).pack(side=tk.LEFT, padx=5)
+        
         self.template_status = ttk.Label(control_frame, text="未设置页码提取区域")
         self.template_status.pack(side=tk.LEFT, padx=5)
         
@@ -130,7 +256,7 @@ class PDFSplitterApp:
         self.h_scrollbar = ttk.Scrollbar(self.canvas_frame, orient=tk.HORIZONTAL, command=self.canvas.xview)
         self.v_scrollbar = ttk.Scrollbar(self.canvas_frame, orient=tk.VERTICAL, command=self.canvas.yview)
         
-        self.canvas.config(xscrollcommand=self.h_scrollbar.set, yscrollcommand=self.v_scrollbar.set)
+        self.canvas.config(xscrollcommand=self.on_canvas_xscroll, yscrollcommand=self.on_canvas_yscroll)
         
         self.h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
         self.v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
@@ -149,10 +275,21 @@ class PDFSplitterApp:
         region_frame = ttk.LabelFrame(right_frame, text="选定区域")
         region_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
-        self.region_listbox = tk.Listbox(region_frame)
-        self.region_listbox.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
-        self.region_listbox.bind("<<ListboxSelect>>", self.on_region_select)
-        self.region_listbox.bind("<Double-Button-1>", self.on_region_double_click)
+        # 每个文件一个节点，展开时才创建下面的行（见update_region_list）
+        tree_frame = ttk.Frame(region_frame)
+        tree_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.region_tree = ttk.Treeview(tree_frame, show="tree", selectmode="browse")
+        region_scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, command=self.region_tree.yview)
+        self.region_tree.configure(yscrollcommand=region_scrollbar.set)
+        region_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.region_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.region_tree.bind("<<TreeviewSelect>>", self.on_region_select)
+        self.region_tree.bind("<<TreeviewOpen>>", self.on_region_tree_open)
+        self.region_tree.bind("<Double-Button-1>", self.on_region_double_click)
+        self.region_files = {}  # 文件节点 -> file_path
+        self.region_nodes = {}  # 尚未展开的节点 -> (file_path, 区域列表)，区域列表为None表示文件节点
+        self.region_items = {}  # 区域行 -> (file_path, region)
+        self.region_rows = {}   # id(region) -> 区域行
         
         region_btn_frame = ttk.Frame(region_frame)
         region_btn_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -172,7 +309,12 @@ class PDFSplitterApp:
             for file_path in files:
                 if file_path not in self.pdf_files:
                     self.pdf_files.append(file_path)
-                    self.selected_regions[file_path] = []  # 为新文件初始化区域列表
+                    self.selected_regions[file_path] = RegionStore()  # 为新文件初始化区域列表
+                    try:
+                        # 读取页数和图幅，之后列表和识别不再重复打开文件
+                        file_index.add(file_path)
+                    except Exception as e:
+                        print(f"读取文件信息失败 {file_path}: {e}")
             
             self.update_file_list()
             
@@ -204,6 +346,11 @@ class PDFSplitterApp:
         
         # 移除文件和相关数据
         self.pdf_files.pop(index)
+        file_index.forget(file_path)
+        self.page_image_cache.forget(file_path)
+        for key in [key for key in self.page_previews if key[0] == file_path]:
+            del self.page_previews[key]
+        self.scanned_pages.pop(file_path, None)
         if file_path in self.selected_regions:
             del self.selected_regions[file_path]
         
@@ -225,6 +372,8 @@ class PDFSplitterApp:
         else:
             # 如果没有文件了，清空显示
             self.pdf_document = None
+            self.display_lists.clear()
+            self.page_text_cache = None
             self.pdf_path = None
             self.current_page = 0
             self.update_page_display()
@@ -232,10 +381,17 @@ class PDFSplitterApp:
 
     def clear_file_list(self):
         """清空文件列表"""
+        for file_path in self.pdf_files:
+            file_index.forget(file_path)
+        self.page_image_cache = PageImageCache()
+        self.page_previews.clear()
         self.pdf_files = []
         self.selected_regions = {}
+        self.scanned_pages = {}
         self.custom_filenames = {}  # 同时清除自定义文件名
         self.pdf_document = None
+        self.display_lists.clear()
+        self.page_text_cache = None
         self.pdf_path = None
         self.current_page = 0
         
@@ -254,113 +410,301 @@ class PDFSplitterApp:
         index = selection[0]
         self.load_pdf_file(index)
 
-    def load_pdf_file(self, index):
-        """加载指定索引的PDF文件"""
+    def load_pdf_file(self, index, scan=True):
+        """加载指定索引的PDF文件，scan为False时不自动识别新页面"""
         if 0 <= index < len(self.pdf_files):
             try:
                 if self.pdf_document:
+                    self.display_lists.clear()  # 显示列表引用原文档的页面
                     self.pdf_document.close()
                 
                 self.current_file_index = index
                 self.pdf_path = self.pdf_files[index]
                 self.pdf_document = fitz.open(self.pdf_path)
+                self.page_text_cache = PageTextCache(self.pdf_document)
                 self.current_page = 0
                 self.update_page_display()
                 
-                # 如果已设置模板，自动识别页码
-                if self.template_coords_set:
-                    self.scan_all_pages()
+                # 如果已设置模板，自动识别还没有识别过的页面（例如新添加的文件）
+                if scan and self.template_coords_set:
+                    self.scan_all_pages(only_unscanned=True)
                 
             except Exception as e:
                 self.showerror("错误", f"无法打开PDF文件: {str(e)}")
 
-    def update_page_display(self):
-        if not self.pdf_document:
+    def _display_list(self, page_num):
+        """返回页面的显示列表，最近使用的几页保留在内存中"""
+        key = (self.pdf_path, page_num)
+        display_list = self.display_lists.get(key)
+        if display_list is None:
+            display_list = self.pdf_document[page_num].get_displaylist()
+            self.display_lists[key] = display_list
+            if len(self.display_lists) > DISPLAY_LIST_PAGES:
+                self.display_lists.popitem(last=False)
+        else:
+            self.display_lists.move_to_end(key)
+        return display_list
+    
+    def _tile_key(self, page_num, zoom, col, row):
+        return (self.pdf_path, page_num, round(zoom, 4), col, row)
+    
+    def _render_tile(self, page_num, zoom, col, row):
+        """渲染页面的一个块（只光栅化块内的区域），返回 (PhotoImage, 左上角坐标)，块在页面外时返回None"""
+        key = self._tile_key(page_num, zoom, col, row)
+        tile = self.page_image_cache.get(key)
+        if tile is None:
+            display_list = self._display_list(page_num)
+            clip = fitz.Rect(col * TILE_SIZE, row * TILE_SIZE, (col + 1) * TILE_SIZE, (row + 1) * TILE_SIZE) / zoom
+            clip &= display_list.rect
+            if clip.is_empty:
+                return None
+            pix = display_list.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip)
+            # 将PyMuPDF的Pixmap转换为PIL Image，再转换为Tkinter可用的PhotoImage
+            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            tile = (ImageTk.PhotoImage(image=img), (pix.x, pix.y))
+            self.page_image_cache.put(key, *tile)
+        return tile
+    
+    def _page_preview(self, page_num):
+        """返回页面的低分辨率预览图 (PIL Image, 缩放比例)，最近使用的几页保留在内存中"""
+        key = (self.pdf_path, page_num)
+        preview = self.page_previews.get(key)
+        if preview is None:
+            display_list = self._display_list(page_num)
+            rect = display_list.rect
+            preview_zoom = min(1.0, PREVIEW_SIZE / max(rect.width, rect.height, 1))
+            pix = display_list.get_pixmap(matrix=fitz.Matrix(preview_zoom, preview_zoom))
+            preview = (Image.frombytes("RGB", [pix.width, pix.height], pix.samples), preview_zoom)
+            self.page_previews[key] = preview
+            if len(self.page_previews) > PREVIEW_PAGES:
+                self.page_previews.popitem(last=False)
+        else:
+            self.page_previews.move_to_end(key)
+        return preview
+    
+    def _preview_tile(self, page_num, zoom, col, row, width, height):
+        """把预览图中对应块的部分放大到块的大小，作为渲染出清晰图像前显示的临时图像"""
+        preview, preview_zoom = self._page_preview(page_num)
+        x, y = col * TILE_SIZE, row * TILE_SIZE
+        tile_width, tile_height = min(TILE_SIZE, width - x), min(TILE_SIZE, height - y)
+        scale = preview_zoom / zoom
+        box = (min(x * scale, preview.width), min(y * scale, preview.height),
+               min((x + tile_width) * scale, preview.width), min((y + tile_height) * scale, preview.height))
+        img = preview.resize((tile_width, tile_height), Image.BILINEAR, box=box)
+        return ImageTk.PhotoImage(image=img), (x, y)
+    
+    def _visible_tiles(self, width, height):
+        """窗口中可见的块 [(列, 行), ...]，width和height为页面图像的大小"""
+        x0, y0 = self.canvas.canvasx(0), self.canvas.canvasy(0)
+        x1 = min(x0 + max(self.canvas.winfo_width(), 1), width)
+        y1 = min(y0 + max(self.canvas.winfo_height(), 1), height)
+        cols = range(max(0, int(x0 // TILE_SIZE)), int(max(x1 - 1, 0) // TILE_SIZE) + 1)
+        rows = range(max(0, int(y0 // TILE_SIZE)), int(max(y1 - 1, 0) // TILE_SIZE) + 1)
+        return [(col, row) for row in rows for col in cols]
+    
+    def show_visible_tiles(self):
+        """显示当前窗口中还没有显示的块
+        
+        已渲染过的块直接使用缓存；没有缓存的块先显示由预览图放大的模糊图像，
+        缩放或翻页时立即有图像显示，清晰的图像稍后由_render_next_tile逐块渲染替换。
+        后台识别时不渲染（避免与识别线程同时使用PyMuPDF），没有缓存的块在识别结束后再显示。
+        """
+        self.tiles_job = None
+        if not self.pdf_document or not self.page_view:
             return
+        page_num, zoom, width, height = self.page_view
+        deferred = False
+        for col, row in self._visible_tiles(width, height):
+            if (col, row) in self.tile_images:
+                continue
+            tile = self.page_image_cache.get(self._tile_key(page_num, zoom, col, row))
+            if tile is None:
+                if self.scan_cancel_event:
+                    deferred = True
+                    continue
+                tile = self._preview_tile(page_num, zoom, col, row, width, height)
+                self.pending_tiles.append((col, row))
+            image, (x, y) = tile
+            self.tile_images[(col, row)] = image
+            item = self.canvas.create_image(x, y, image=image, anchor=tk.NW, tags="pdf_image")
+            self.tile_items[(col, row)] = item
+            self.canvas.tag_lower(item)  # 页面图像在区域矩形下面
+        
+        if deferred:
+            self.tiles_job = self.root.after(SCAN_POLL_MS, self.show_visible_tiles)
+        if self.pending_tiles and not self.render_job:
+            self.render_job = self.root.after(SHARP_RENDER_DELAY_MS, self._render_next_tile)
+    
+    def _render_next_tile(self):
+        """渲染一个显示着模糊图像的块，并在画布上替换为清晰的图像
         
-        # 清除当前画布
-        self.canvas.delete("all")
+        PyMuPDF渲染时不释放GIL，也不支持多线程使用同一文档，后台线程渲染同样会让界面停顿，
+        因此在主线程中每次只渲染一块，块之间处理用户操作；继续缩放或翻页时
+        update_page_display会取消尚未渲染的块。已滚动到窗口外的块不再渲染，滚动回来时重新显示。
+        后台识别时与_prefetch_next一样不使用PyMuPDF，等识别结束后再渲染。
+        """
+        self.render_job = None
+        if not self.pdf_document or not self.page_view:
+            return
+        if self.scan_cancel_event:
+            self.render_job = self.root.after(SCAN_POLL_MS, self._render_next_tile)
+            return
+        page_num, zoom, width, height = self.page_view
+        visible = set(self._visible_tiles(width, height))
+        while self.pending_tiles:
+            col, row = self.pending_tiles.pop(0)
+            if (col, row) in visible:
+                tile = self._render_tile(page_num, zoom, col, row)
+                if tile is not None:
+                    image, (x, y) = tile
+                    item = self.tile_items[(col, row)]
+                    self.tile_images[(col, row)] = image
+                    self.canvas.itemconfig(item, image=image)
+                    self.canvas.coords(item, x, y)
+                break
+            self.canvas.delete(self.tile_items.pop((col, row)))
+            del self.tile_images[(col, row)]
         
-        # 获取当前页面
-        page = self.pdf_document[self.current_page]
+        if self.pending_tiles:
+            self.render_job = self.root.after(SHARP_RENDER_DELAY_MS, self._render_next_tile)
+    
+    def on_canvas_xscroll(self, first, last):
+        """画布水平滚动或改变大小时，更新滚动条并显示新出现的块"""
+        self.h_scrollbar.set(first, last)
+        self._schedule_visible_tiles()
+    
+    def on_canvas_yscroll(self, first, last):
+        """画布垂直滚动或改变大小时，更新滚动条并显示新出现的块"""
+        self.v_scrollbar.set(first, last)
+        self._schedule_visible_tiles()
+    
+    def _schedule_visible_tiles(self):
+        # 连续的滚动事件只渲染一次
+        if not self.tiles_job:
+            self.tiles_job = self.root.after_idle(self.show_visible_tiles)
+    
+    def _schedule_prefetch(self):
+        """显示页面后，稍后在主线程中逐页预渲染前后的页面
         
-        # 渲染页面到图像
-        zoom = 2.0 * self.scale_factor  # 提高分辨率
-        mat = fitz.Matrix(zoom, zoom)
-        pix = page.get_pixmap(matrix=mat)
+        PyMuPDF渲染时不释放GIL，也不支持多线程使用同一文档，因此不使用后台线程；
+        每次只渲染一页，翻页时取消尚未执行的预渲染。
+        """
+        if self.prefetch_job:
+            self.root.after_cancel(self.prefetch_job)
+            self.prefetch_job = None
+        
+        page_count = len(self.pdf_document)
+        self.prefetch_pages = []
+        for offset in range(1, PREFETCH_PAGES + 1):
+            for page_num in (self.current_page + offset, self.current_page - offset):
+                if 0 <= page_num < page_count:
+                    self.prefetch_pages.append(page_num)
+        if self.prefetch_pages:
+            self.prefetch_job = self.root.after(PREFETCH_DELAY_MS, self._prefetch_next)
+    
+    def _prefetch_next(self):
+        """预渲染下一页"""
+        self.prefetch_job = None
+        if not self.pdf_document or not self.prefetch_pages or self.scan_cancel_event:
+            return  # 后台识别时不预渲染，避免与识别线程同时使用PyMuPDF
+        if self.pending_tiles:
+            # 先渲染当前页面的清晰图像
+            self.prefetch_job = self.root.after(PREFETCH_DELAY_MS, self._prefetch_next)
+            return
         
-        # 将PyMuPDF的Pixmap转换为PIL Image
-        img_data = pix.samples
-        img = Image.frombytes("RGB", [pix.width, pix.height], img_data)
+        # 预渲染相邻页面上与当前窗口位置相同的块
+        page_num = self.prefetch_pages.pop(0)
+        _, zoom, width, height = self.page_view
+        for col, row in self._visible_tiles(width, height):
+            self._render_tile(page_num, zoom, col, row)
         
-        # 转换为Tkinter可用的PhotoImage
-        self.tk_img = ImageTk.PhotoImage(image=img)
+        if self.prefetch_pages:
+            self.prefetch_job = self.root.after(1, self._prefetch_next)
+    
+    def update_page_display(self):
+        if not self.pdf_document:
+            return
         
-        # 在画布上显示图像
-        self.canvas.create_image(0, 0, image=self.tk_img, anchor=tk.NW, tags="pdf_image")
+        # 清除当前画布，取消上次显示时尚未渲染完的块
+        self.canvas.delete("all")
+        self.tile_images = {}
+        self.tile_items = {}
+        self.pending_tiles = []
+        if self.render_job:
+            self.root.after_cancel(self.render_job)
+            self.render_job = None
+        
+        # 页面图像（提高分辨率）的大小，作为画布滚动区域
+        zoom = 2.0 * self.scale_factor
+        rect = self.pdf_document[self.current_page].rect
+        width, height = math.ceil(rect.width * zoom), math.ceil(rect.height * zoom)
+        self.page_view = (self.current_page, zoom, width, height)
+        self.canvas.config(scrollregion=(0, 0, width, height))
         
-        # 配置画布滚动区域
-        self.canvas.config(scrollregion=self.canvas.bbox("all"))
+        # 只渲染窗口中可见的块，其余的块在滚动到时再渲染；已渲染过的块直接使用缓存
+        self.show_visible_tiles()
         
         # 更新页面标签
         self.page_label.config(text=f"页面: {self.current_page + 1} / {len(self.pdf_document)}")
         
-        # 重新绘制所有选定区域
+        # 重新绘制所有选定区域（包括文件名模板区域）
         self.redraw_regions()
         
-        # 记得保持所有模式的状态
-        if self.filename_template_mode:
-            self.redraw_filename_regions()
+        self._schedule_prefetch()
     
     def redraw_regions(self):
-        """重新绘制当前页面上的所有选定区域"""
+        """重新绘制当前页面上的所有选定区域
+        
+        区域和模板矩形都带有"overlay"标签，与页面图像的块分开，
+        重新绘制时只删除和创建这些矩形，不重新渲染页面。
+        """
         if not self.pdf_path:
             return
         
         # 清除所有现有的区域矩形
-        self.canvas.delete("region_*")
+        self.canvas.delete("overlay")
             
         # 如果当前文件有选定区域，绘制它们
         if self.pdf_path in self.selected_regions:
-            # 获取当前文件的区域列表
-            regions = self.selected_regions[self.pdf_path]
+            # 只取当前页面上的区域
+            regions = self.selected_regions[self.pdf_path].on_page(self.current_page)
             
             # 绘制当前页面上的所有选定区域
             for i, region in enumerate(regions):
-                if region['page'] == self.current_page:
-                    x1, y1, x2, y2 = region['rect']
-                    # 如果是文件名区域，使用蓝色
-                    if region.get('is_filename', False):
-                        self.canvas.create_rectangle(x1, y1, x2, y2, outline="blue", width=2, tags=f"region_{i}")
-                        
-                        # 如果存在多个区域坐标，也绘制它们
-                        if 'all_coords' in region:
-                            for j, coords in enumerate(region['all_coords']):
-                                if j > 0:  # 跳过第一个坐标，因为它已经被绘制了
-                                    x1, y1, x2, y2 = coords
-                                    self.canvas.create_rectangle(x1, y1, x2, y2, outline="blue", width=2, 
-                                                              tags=f"region_{i}_part_{j}")
-                    else:
-                        self.canvas.create_rectangle(x1, y1, x2, y2, outline="green", width=2, tags=f"region_{i}")
+                x1, y1, x2, y2 = region['rect']
+                # 如果是文件名区域，使用蓝色
+                if region.get('is_filename', False):
+                    self.canvas.create_rectangle(x1, y1, x2, y2, outline="blue", width=2,
+                                                 tags=("overlay", f"region_{i}"))
+                    
+                    # 如果存在多个区域坐标，也绘制它们
+                    if 'all_coords' in region:
+                        for j, coords in enumerate(region['all_coords']):
+                            if j > 0:  # 跳过第一个坐标，因为它已经被绘制了
+                                x1, y1, x2, y2 = coords
+                                self.canvas.create_rectangle(x1, y1, x2, y2, outline="blue", width=2, 
+                                                          tags=("overlay", f"region_{i}_part_{j}"))
+                else:
+                    self.canvas.create_rectangle(x1, y1, x2, y2, outline="green", width=2,
+                                                 tags=("overlay", f"region_{i}"))
         
         # 如果正在设置文件名模板，显示已选择的模板区域
-        if self.filename_template_mode:
-            for i, coords in enumerate(self.filename_template_coords):
-                x1, y1, x2, y2 = coords
-                self.canvas.create_rectangle(x1, y1, x2, y2, outline="orange", width=2, 
-                                          tags=f"filename_region_{i+1}")
+        self.redraw_filename_regions()
         
         # 如果正在设置页码模板，显示已选择的模板区域
         if self.template_mode == "double" and self.current_page_coords:
             x1, y1, x2, y2 = self.current_page_coords
-            self.canvas.create_rectangle(x1, y1, x2, y2, outline="purple", width=2, tags="template_current")
+            self.canvas.create_rectangle(x1, y1, x2, y2, outline="purple", width=2,
+                                         tags=("overlay", "template_current"))
             
             if self.total_pages_coords:
                 x1, y1, x2, y2 = self.total_pages_coords
-                self.canvas.create_rectangle(x1, y1, x2, y2, outline="purple", width=2, tags="template_total")
+                self.canvas.create_rectangle(x1, y1, x2, y2, outline="purple", width=2,
+                                             tags=("overlay", "template_total"))
         elif self.template_mode == "single" and self.current_page_coords:
             x1, y1, x2, y2 = self.current_page_coords
-            self.canvas.create_rectangle(x1, y1, x2, y2, outline="purple", width=2, tags="template_single")
+            self.canvas.create_rectangle(x1, y1, x2, y2, outline="purple", width=2,
+                                         tags=("overlay", "template_single"))
     
     def prev_page(self):
         if self.pdf_document and self.current_page > 0:
@@ -431,6 +775,23 @@ class PDFSplitterApp:
         x2 = max(self.start_x, end_x)
         y2 = max(self.start_y, end_y)
         
+        if self.replace_target is not None:
+            # 只替换一个模板区域，然后重新识别；其他区域没有变化，识别结果直接使用缓存
+            coords = (x1, y1, x2, y2)
+            if self.replace_target == 'page':
+                self.current_page_coords = coords
+            elif self.replace_target == 'total':
+                self.total_pages_coords = coords
+            else:
+                self.filename_template_coords[self.replace_target[1]] = coords
+            self.replace_target = None
+            self.canvas.delete("selection")
+            self.rect_id = None
+            self.redraw_regions()
+            self.template_status.config(text='正在重新识别...')
+            self.rescan_all_templates()
+            return
+        
         if self.filename_template_mode:
             # 文件名模板模式
             self.template_region_count += 1
@@ -442,7 +803,8 @@ class PDFSplitterApp:
             
             # 创建一个橙色矩形标记已选区域 (改为橙色以与其他区域区分)
             self.canvas.create_rectangle(x1, y1, x2, y2, outline="orange", width=2, 
-                                       tags=f"filename_region_{self.template_region_count}")
+                                       tags=("overlay", "filename_region",
+                                             f"filename_region_{self.template_region_count}"))
             
             # 删除选择框
             self.canvas.delete(self.rect_id)
@@ -476,19 +838,11 @@ class PDFSplitterApp:
                 return
                 
             text = self.extract_text_from_selection(x1, y1, x2, y2)
-            region = {
-                'page': self.current_page,
-                'rect': (x1, y1, x2, y2),
-                'text': text if text else "",  # 即使没有文本也保存空字符串
-                'has_text': bool(text.strip())  # 添加标记表示是否有文本
-            }
-            
-            # 确保当前文件的区域列表已初始化
-            if self.pdf_path not in self.selected_regions:
-                self.selected_regions[self.pdf_path] = []
+            # 即使没有文本也保存空字符串
+            region = Region(self.current_page, rect=(x1, y1, x2, y2), text=text if text else "")
             
             # 添加到当前文件的区域列表
-            self.selected_regions[self.pdf_path].append(region)
+            self.selected_regions.setdefault(self.pdf_path, RegionStore()).add(region)
             self.update_region_list()
         
         # 删除临时选择矩形，重新绘制所有区域
@@ -497,255 +851,257 @@ class PDFSplitterApp:
         self.redraw_regions()
     
     def _extract_text_from_rect(self, page, rect):
-        """Helper method to extract and sort text from a given rectangle on a page."""
-        try:
-            # Use dict mode for better structure
-            blocks = page.get_text("dict", clip=rect)["blocks"]
-            
-            # Define line tolerance based on zoom (assuming default zoom/scale)
-            # TODO: Consider passing scale factor if needed for dynamic tolerance
-            line_tolerance = 5 / (2.0 * self.scale_factor) 
-            
-            all_spans = []
-            for block in blocks:
-                if block["type"] == 0:  # Text block
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            y_pos = (span["bbox"][1] + span["bbox"][3]) / 2
-                            x_pos = span["bbox"][0]
-                            all_spans.append((y_pos, x_pos, span["text"]))
-            
-            if not all_spans:
-                return ""
-                
-            # Sort primarily by Y, then X
-            all_spans.sort(key=lambda x: (x[0], x[1]))
-            
-            # Group spans into lines based on Y-coordinate and tolerance
-            lines = []
-            if all_spans:
-                current_line = [all_spans[0]]
-                last_y = all_spans[0][0]
-                
-                for span in all_spans[1:]:
-                    span_y = span[0]
-                    if abs(span_y - last_y) < line_tolerance:
-                        current_line.append(span)
-                    else:
-                        # Sort current line by X before adding
-                        current_line.sort(key=lambda x: x[1])
-                        lines.append(current_line)
-                        # Start new line
-                        current_line = [span]
-                        last_y = span_y
-                
-                # Add the last line
-                current_line.sort(key=lambda x: x[1])
-                lines.append(current_line)
-            
-            # Join text within lines and then join lines
-            result_text = " ".join([" ".join(span[2] for span in line) for line in lines])
-            
-        except Exception as e:
-            print(f"Warning: Text extraction using dict failed, falling back. Error: {e}")
-            # Fallback to simple text extraction
-            try:
-                result_text = page.get_text("text", clip=rect)
-            except Exception as fallback_e:
-                print(f"Error: Fallback text extraction failed. Error: {fallback_e}")
-                result_text = ""
-        
-        # Clean up whitespace
-        text = result_text.replace('\\n', ' ').replace('\\r', ' ')
-        text = re.sub(r'\\s+', ' ', text).strip()
-        return text
+        """从页面的指定区域（PDF坐标）提取并排序文本"""
+        # 行容差：5个画布像素换算为PDF坐标
+        line_tolerance = 5 / (2.0 * self.scale_factor)
+        if self.page_text_cache and page.parent == self.pdf_document:
+            # 当前文件的页面使用缓存，重复框选时不再重新解析页面内容
+            return self.page_text_cache.extract_text(page.number, rect, line_tolerance)
+        return extract_text_from_rect(page, rect, line_tolerance)
+
+    def _to_pdf_rect(self, coords):
+        """将画布坐标转换为PDF坐标"""
+        return canvas_to_pdf_rect(coords, 2.0 * self.scale_factor)
+
+    def _build_template(self):
+        """根据当前框选的区域创建识别模板（PDF坐标）"""
+        return make_template(
+            mode=self.template_mode,
+            page_rect=self._to_pdf_rect(self.current_page_coords) if self.current_page_coords else None,
+            total_rect=self._to_pdf_rect(self.total_pages_coords) if self.total_pages_coords else None,
+            filename_rects=[self._to_pdf_rect(coords) for coords in self.filename_template_coords],
+        )
+
+    def _pages_to_scan(self, unscanned_key=None):
+        """返回需要识别的页面 [(file_path, [page_num, ...]), ...]
+
+        如果正在为特定图幅设置模板，只返回该图幅的页面。
+        给出unscanned_key（页码模板，见_page_template_key）时，只返回还没有用这个模板识别过的页面。
+        """
+        pages_to_process = []
+        for file_path in self.pdf_files:
+            if self.current_size_key:
+                page_nums = list(self.page_sizes.get(file_path, {}).get(self.current_size_key) or [])
+            else:
+                page_nums = list(range(get_page_count(file_path)))
+            if unscanned_key is not None:
+                scanned_key, scanned = self.scanned_pages.get(file_path, (None, ()))
+                if scanned_key == unscanned_key:
+                    page_nums = [page_num for page_num in page_nums if page_num not in scanned]
+            if page_nums:
+                pages_to_process.append((file_path, page_nums))
+        return pages_to_process
+
+    @staticmethod
+    def _page_template_key(template):
+        """页码模板的标识，页码区域和模式相同时相同"""
+        return json.dumps([template['mode'], template['page_rect'], template['total_rect']])
+
+    def _mark_scanned(self, file_path, template_key, page_nums):
+        """记录已经用页码模板识别过的页面，模板改变时重新记录"""
+        scanned_key, scanned = self.scanned_pages.get(file_path, (None, None))
+        if scanned_key != template_key:
+            scanned = set()
+            self.scanned_pages[file_path] = (template_key, scanned)
+        scanned.update(page_nums)
+
+    def _find_region(self, file_path, page_num):
+        """查找指定页面的区域，不存在时返回None"""
+        regions = self.selected_regions.get(file_path)
+        return regions.get(page_num) if regions else None
+
+    def _clear_page_number_results(self, file_path, page_nums):
+        """清除指定页面的页码识别结果，保留文件名区域"""
+        if file_path in self.selected_regions:
+            self.selected_regions[file_path].clear_page_numbers(page_nums)
+
+    def _apply_page_number_result(self, file_path, page_num, result, page_coords):
+        """将页码识别结果写入区域列表，page_coords为开始识别时的页码区域（画布坐标）"""
+        region = self._find_region(file_path, page_num)
+        if region:
+            # 如果已有区域（例如文件名区域），将页码信息添加到现有区域
+            region.set_page_number(result['current_page'], result['total_pages'])
+        else:
+            self.selected_regions.setdefault(file_path, RegionStore()).add(
+                Region(page_num, rect=page_coords,
+                       current_page=result['current_page'], total_pages=result['total_pages']))
+
+    def _apply_filename_result(self, file_path, page_num, filename, all_coords):
+        """将文件名识别结果写入区域列表和自定义文件名字典，all_coords为开始识别时的文件名区域"""
+        if filename:
+            self.custom_filenames.setdefault(file_path, {})[page_num] = filename
+        display_name = filename if filename else NO_CONTENT
+
+        region = self._find_region(file_path, page_num)
+        if region:
+            region.set_filename(display_name, all_coords)
+        else:
+            self.selected_regions.setdefault(file_path, RegionStore()).add(
+                Region(page_num, rect=all_coords[0], all_coords=all_coords, filename=display_name))
 
     def extract_text_from_selection(self, x1, y1, x2, y2):
         if not self.pdf_document:
             return ""
         
-        # Get current page
         page = self.pdf_document[self.current_page]
-        
-        # Calculate selection rectangle in PDF coordinates
-        zoom = 2.0 * self.scale_factor
-        pdf_rect = fitz.Rect(x1 / zoom, y1 / zoom, x2 / zoom, y2 / zoom)
-        
-        return self._extract_text_from_rect(page, pdf_rect)
+        return self._extract_text_from_rect(page, self._to_pdf_rect((x1, y1, x2, y2)))
 
     def update_region_list(self):
-        """更新区域列表显示"""
-        # 清除列表
-        self.region_listbox.delete(0, tk.END)
-        
-        # 存储列表索引到文件路径和页码的映射
-        self.region_map = {}
-        current_index = 0
-        
-        # 检查是否有任何区域
-        has_any_regions = False
-        for file_path in self.pdf_files:
-            if file_path in self.selected_regions and self.selected_regions[file_path]:
-                has_any_regions = True
-                break
+        """更新区域列表显示
+
+        只为每个有区域的文件创建一个节点，文件（以及其中的图幅、页码范围）展开时才创建下面的行，
+        因此列表中的行数只取决于展开的部分，与总页数无关。已展开的文件在更新后保持展开。
+        """
+        tree = self.region_tree
+        open_files = [self.region_files[iid] for iid in tree.get_children()
+                      if iid in self.region_files and tree.item(iid, 'open')]
+        tree.delete(*tree.get_children())
+        self.region_files = {}
+        self.region_nodes = {}
+        self.region_items = {}
+        self.region_rows = {}
         
         if not self.pdf_files:
             # 如果没有文件，显示提示信息
-            self.region_listbox.insert(tk.END, "请先添加PDF文件")
+            tree.insert("", tk.END, text="请先添加PDF文件")
             return
-        elif not has_any_regions:
+        
+        files_with_regions = [file_path for file_path in self.pdf_files if self.selected_regions.get(file_path)]
+        if not files_with_regions:
             # 如果有文件但没有区域，显示提示信息
-            self.region_listbox.insert(tk.END, "请在PDF上选择区域")
+            tree.insert("", tk.END, text="请在PDF上选择区域")
             return
         
-        # 按图幅尺寸分组显示
-        for file_path in self.pdf_files:
-            file_name = os.path.basename(file_path)
-            regions = self.selected_regions.get(file_path, [])
-            
-            if not regions:
-                continue  # 跳过没有区域的文件
-            
-            # 添加文件名作为标题
-            self.region_listbox.insert(tk.END, f"=== {file_name} ===")
-            current_index += 1
+        for file_path in files_with_regions:
+            iid = self._insert_region_node("", os.path.basename(file_path), file_path, None)
+            self.region_files[iid] = file_path
+            if file_path in open_files:
+                self._populate_region_node(iid)
+                tree.item(iid, open=True)
+    
+    def _insert_region_node(self, parent, text, file_path, regions):
+        """插入一个可展开的节点，展开时再创建其中的区域行"""
+        iid = self.region_tree.insert(parent, tk.END, text=text)
+        self.region_tree.insert(iid, tk.END, text="")  # 占位，使节点显示为可展开
+        self.region_nodes[iid] = (file_path, regions)
+        return iid
+    
+    def _populate_region_node(self, iid):
+        """创建节点下的行：文件按图幅分组，区域较多时按页码范围分组，否则直接显示区域"""
+        node = self.region_nodes.pop(iid, None)
+        if node is None:
+            return  # 已经展开过
+        file_path, regions = node
+        tree = self.region_tree
+        tree.delete(*tree.get_children(iid))
+        
+        if regions is None:
+            regions = list(self.selected_regions.get(file_path, ()))  # RegionStore按页码顺序返回
             
             # 如果有图幅信息，按图幅分组显示
-            if file_path in self.page_sizes and self.page_sizes[file_path]:
-                # 创建页码到尺寸的映射
+            if self.page_sizes.get(file_path):
                 page_to_size = {}
                 for size_key, pages in self.page_sizes[file_path].items():
                     for page_num in pages:
                         page_to_size[page_num] = size_key
                 
-                # 按图幅分组区域
                 size_groups = {}
                 for region in regions:
-                    page_num = region['page']
-                    size_key = page_to_size.get(page_num, "未知尺寸")
-                    if size_key not in size_groups:
-                        size_groups[size_key] = []
-                    size_groups[size_key].append(region)
+                    size_groups.setdefault(page_to_size.get(region['page'], "未知尺寸"), []).append(region)
                 
-                # 显示每个图幅组的区域
                 for size_key in sorted(size_groups.keys()):
-                    # 添加图幅尺寸标题
                     template_status = "（已设置模板）" if size_key in self.page_templates else "（未设置模板）"
-                    self.region_listbox.insert(tk.END, f"--- 图幅：{size_key} {template_status} ---")
-                    current_index += 1
-                    
-                    # 显示该图幅下的区域
-                    for region in sorted(size_groups[size_key], key=lambda x: x['page']):
-                        page_num = region['page'] + 1
-                        
-                        if 'current_page' in region and 'filename' in region:
-                            # 既有页码又有文件名
-                            item_text = f"页面 {page_num}: [第 {region['current_page']} 张] [{region['filename']}]"
-                        elif region.get('is_filename'):
-                            # 只有文件名
-                            item_text = f"页面 {page_num}: [文件名] {region['filename']}"
-                        elif 'current_page' in region and 'total_pages' in region:
-                            # 只有页码
-                            item_text = f"页面 {page_num}: 第 {region['current_page']} 张 共 {region['total_pages']} 张"
-                        else:
-                            # 普通区域
-                            text_preview = region['text'].strip()
-                            if not text_preview:
-                                item_text = f"页面 {page_num}: [无内容]"
-                            else:
-                                if len(text_preview) > 30:
-                                    text_preview = text_preview[:30] + "..."
-                                item_text = f"页面 {page_num}: {text_preview}"
-                        
-                        self.region_listbox.insert(tk.END, item_text)
-                        # 保存映射关系
-                        self.region_map[current_index] = (file_path, region['page'])
-                        current_index += 1
-                    
-                    # 添加空行分隔不同图幅
-                    self.region_listbox.insert(tk.END, "")
-                    current_index += 1
-            else:
-                # 如果没有图幅信息，按原来的方式显示
-                for region in sorted(regions, key=lambda x: x['page']):
-                    page_num = region['page'] + 1
-                    
-                    if 'current_page' in region and 'filename' in region:
-                        item_text = f"页面 {page_num}: [第 {region['current_page']} 张] [{region['filename']}]"
-                    elif region.get('is_filename'):
-                        item_text = f"页面 {page_num}: [文件名] {region['filename']}"
-                    elif 'current_page' in region and 'total_pages' in region:
-                        item_text = f"页面 {page_num}: 第 {region['current_page']} 张 共 {region['total_pages']} 张"
-                    else:
-                        text_preview = region['text'].strip()
-                        if not text_preview:
-                            item_text = f"页面 {page_num}: [无内容]"
-                        else:
-                            if len(text_preview) > 30:
-                                text_preview = text_preview[:30] + "..."
-                            item_text = f"页面 {page_num}: {text_preview}"
-                    
-                    self.region_listbox.insert(tk.END, item_text)
-                    # 保存映射关系
-                    self.region_map[current_index] = (file_path, region['page'])
-                    current_index += 1
-            
-            # 添加空行分隔不同文件
-            self.region_listbox.insert(tk.END, "")
-            current_index += 1
+                    self._insert_region_node(iid, f"图幅：{size_key} {template_status}", file_path,
+                                             size_groups[size_key])
+                return
+        
+        if len(regions) > REGION_LIST_CHUNK:
+            for start in range(0, len(regions), REGION_LIST_CHUNK):
+                chunk = regions[start:start + REGION_LIST_CHUNK]
+                self._insert_region_node(iid, f"页面 {chunk[0]['page'] + 1} - {chunk[-1]['page'] + 1}",
+                                         file_path, chunk)
+            return
+        
+        for region in regions:
+            row = tree.insert(iid, tk.END, text=self._region_row_text(region))
+            self.region_items[row] = (file_path, region)
+            self.region_rows[id(region)] = row
+    
+    def _region_row_text(self, region):
+        """区域在列表中显示的文字"""
+        page_num = region['page'] + 1
+        
+        if 'current_page' in region and 'filename' in region:
+            # 既有页码又有文件名
+            return f"页面 {page_num}: [第 {region['current_page']} 张] [{region['filename']}]"
+        if region.get('is_filename'):
+            # 只有文件名
+            return f"页面 {page_num}: [文件名] {region['filename']}"
+        if 'current_page' in region and 'total_pages' in region:
+            # 只有页码
+            return f"页面 {page_num}: 第 {region['current_page']} 张 共 {region['total_pages']} 张"
+        
+        # 普通区域
+        text_preview = region['text'].strip()
+        if not text_preview:
+            return f"页面 {page_num}: [无内容]"
+        if len(text_preview) > 30:
+            text_preview = text_preview[:30] + "..."
+        return f"页面 {page_num}: {text_preview}"
+    
+    def update_region_row(self, region):
+        """只更新区域对应的一行（所在节点尚未展开时没有对应的行，不需要更新）"""
+        row = self.region_rows.get(id(region))
+        if row:
+            self.region_tree.item(row, text=self._region_row_text(region))
+    
+    def on_region_tree_open(self, event):
+        """展开区域列表中的节点时创建下面的行"""
+        self._populate_region_node(self.region_tree.focus())
+    
+    def _selected_region(self):
+        """返回区域列表中选中的 (file_path, region)，选中的不是区域行时返回None"""
+        selection = self.region_tree.selection()
+        if not selection:
+            return None
+        return self.region_items.get(selection[0])
     
     def on_region_select(self, event):
         """处理区域列表的单击选择事件"""
-        # 获取选中的索引
-        selection = self.region_listbox.curselection()
-        if not selection:
-            return
-        
-        index = selection[0]
-        if index not in self.region_map:
-            return  # 如果选择的是标题行或空行，则不做处理
+        selected = self._selected_region()
+        if not selected:
+            return  # 如果选择的是文件、图幅等分组行，则不做处理
             
         # 获取文件路径和页码
-        file_path, page_num = self.region_map[index]
+        file_path, region = selected
+        page_num = region['page']
         
         # 如果当前文件与选中的不同，加载新文件
         if self.pdf_path != file_path:
             self.load_pdf_file(self.pdf_files.index(file_path))
         
-        # 跳转到指定页面
-        self.current_page = page_num
-        self.update_page_display()
+        # 跳转到指定页面（已经在这一页时不需要重新显示页面）
+        if self.current_page != page_num:
+            self.current_page = page_num
+            self.update_page_display()
     
     def on_region_double_click(self, event):
-        """处理区域列表的双击事件"""
+        """处理区域列表的双击事件，双击文件、图幅或页码范围行只展开/折叠，不提示"""
+        if self._selected_region() is None:
+            return
         self.edit_selected_content()
     
     def edit_selected_content(self):
         """编辑选中区域的内容"""
-        selection = self.region_listbox.curselection()
-        if not selection:
+        selected = self._selected_region()
+        if not selected:
             self.showwarning("警告", "请先选择一个区域")
             return
             
-        index = selection[0]
-        if index not in self.region_map:
-            return
-            
-        # 获取文件路径和页码
-        file_path, page_num = self.region_map[index]
-        
-        # 找到对应的区域
-        region = None
-        for r in self.selected_regions[file_path]:
-            if r['page'] == page_num:
-                region = r
-                break
-                
-        if not region:
-            return
+        file_path, region = selected
             
         # 显示编辑对话框
-        self.show_content_edit_dialog(file_path, page_num, region)
+        self.show_content_edit_dialog(file_path, region['page'], region)
     
     def show_content_edit_dialog(self, file_path, page_num, region):
         """显示内容编辑对话框"""
@@ -811,9 +1167,7 @@ class PDFSplitterApp:
             # 更新区域信息
             if region.get('is_filename', False):
                 # 如果是文件名区域
-                region['filename'] = new_text
-                region['filename_text'] = f"文件名: {new_text}"
-                region['text'] = f"文件名: {new_text}"
+                region.set_filename(new_text)
                 
                 # 更新自定义文件名字典
                 if file_path not in self.custom_filenames:
@@ -821,10 +1175,10 @@ class PDFSplitterApp:
                 self.custom_filenames[file_path][page_num] = new_text
             else:
                 # 如果是普通区域
-                region['text'] = new_text
+                region.text = new_text
             
-            # 更新显示
-            self.update_region_list()
+            # 只更新该区域对应的一行
+            self.update_region_row(region)
             dialog.destroy()
             
             # 显示成功消息
@@ -855,32 +1209,30 @@ class PDFSplitterApp:
     
     def remove_region(self):
         """删除选中的区域"""
-        selection = self.region_listbox.curselection()
-        if not selection:
+        selected = self._selected_region()
+        if not selected:
             return
         
-        index = selection[0]
-        
-        # 找到对应的文件和区域
-        current_index = 0
-        for file_path in self.pdf_files:
-            regions = self.selected_regions.get(file_path, [])
-            if index - current_index < len(regions) + 1:  # +1 是因为文件标题行
-                region_index = index - current_index - 1  # -1 是因为文件标题行
-                if region_index >= 0:
-                    del self.selected_regions[file_path][region_index]
-                break
-            current_index += len(regions) + 2  # +2 是因为文件标题行和空行
+        file_path, region = selected
+        regions = self.selected_regions.get(file_path, RegionStore())
+        regions.remove(region)
         
-        self.update_region_list()
-        self.update_page_display()
+        if regions:
+            # 只删除对应的一行
+            row = self.region_rows.pop(id(region))
+            self.region_items.pop(row, None)
+            self.region_tree.delete(row)
+        else:
+            self.update_region_list()
+        self.redraw_regions()
     
     def clear_regions(self):
         """清除所有区域"""
         if self.pdf_path:
-            self.selected_regions[self.pdf_path] = []
+            self.selected_regions[self.pdf_path] = RegionStore()
+            self.scanned_pages.pop(self.pdf_path, None)  # 重新打开文件时再识别
         self.update_region_list()
-        self.update_page_display()
+        self.redraw_regions()
         # Removing the line below which is causing the error
         # self.update_text_display("选择一个区域以查看提取的文本")
     
@@ -924,220 +1276,238 @@ class PDFSplitterApp:
         except Exception as e:
             self.showerror("错误", f"设置页码信息失败: {str(e)}")
     
-    def scan_all_pages(self):
-        """遍历所有PDF文件并识别页码"""
-        if not self.current_page_coords:  # 至少需要一个坐标
+    def _start_scan(self, label_text, template, apply_results, on_finish, error_message,
+                    line_tolerance=DEFAULT_LINE_TOLERANCE, pages_to_scan=None):
+        """在后台线程中识别所有待识别页面，显示进度窗口和取消按钮
+
+        后台线程只负责识别，结果放入队列；主线程每隔SCAN_POLL_MS毫秒取出队列中的所有结果，
+        调用apply_results(file_path, page_nums, results)合并，然后刷新一次进度。
+        识别完成后调用on_finish(processed_pages, total_pages)；取消时保留已合并的结果。
+        pages_to_scan返回要识别的页面，默认为_pages_to_scan。
+        """
+        if self.scan_cancel_event:
+            self.showwarning("提示", "正在识别，请等待完成或取消后再试")
             return
-            
-        try:
-            # 显示进度窗口
-            progress_window = tk.Toplevel(self.root)
-            progress_window.title("识别进度")
-            progress_window.geometry("300x150")
-            progress_window.transient(self.root)  # 设置为主窗口的子窗口
-            self.center_dialog(progress_window)  # 居中显示
-            
-            progress_label = ttk.Label(progress_window, text="正在识别页码...")
-            progress_label.pack(pady=10)
-            
-            progress_var = tk.DoubleVar()
-            progress_bar = ttk.Progressbar(progress_window, variable=progress_var, maximum=100)
-            progress_bar.pack(fill=tk.X, padx=20, pady=10)
-            
-            # 计算总页数和需要处理的页面
-            total_pages_to_process = 0
-            pages_to_process = []  # [(file_path, page_num), ...]
-            
-            for file_path in self.pdf_files:
-                if self.current_size_key:
-                    # 如果是为特定图幅设置模板，只处理该图幅的页面
-                    if self.current_size_key in self.page_sizes[file_path]:
-                        page_nums = self.page_sizes[file_path][self.current_size_key]
-                        total_pages_to_process += len(page_nums)
-                        pages_to_process.extend([(file_path, page_num) for page_num in page_nums])
-                else:
-                    # 如果不是特定图幅，处理所有页面
-                    pdf = fitz.open(file_path)
-                    total_pages_to_process += len(pdf)
-                    pages_to_process.extend([(file_path, i) for i in range(len(pdf))])
-                    pdf.close()
-            
-            processed_pages = 0
-            total_pages_recognized = 0
-            
-            # 保存现有的文件名区域
-            saved_filename_regions = {}
-            for file_path in self.pdf_files:
-                if file_path in self.selected_regions:
-                    filename_regions = [region for region in self.selected_regions[file_path] 
-                                      if region.get('is_filename', False)]
-                    if filename_regions:
-                        saved_filename_regions[file_path] = filename_regions
-            
-            # 处理每个页面
-            current_pdf = None
+        
+        # 显示进度窗口
+        progress_window = tk.Toplevel(self.root)
+        progress_window.title("识别进度")
+        progress_window.geometry("300x150")
+        progress_window.transient(self.root)  # 设置为主窗口的子窗口
+        self.center_dialog(progress_window)  # 居中显示
+        
+        progress_label = ttk.Label(progress_window, text=label_text)
+        progress_label.pack(pady=10)
+        
+        progress_var = tk.DoubleVar()
+        progress_bar = ttk.Progressbar(progress_window, variable=progress_var, maximum=100)
+        progress_bar.pack(fill=tk.X, padx=20, pady=10)
+        
+        cancel_event = threading.Event()
+        self.scan_cancel_event = cancel_event
+        
+        def on_cancel():
+            cancel_event.set()
+            cancel_btn.config(state=tk.DISABLED)
+            progress_label.config(text="正在取消...")
+        
+        cancel_btn = ttk.Button(progress_window, text="取消", command=on_cancel)
+        cancel_btn.pack(pady=5)
+        progress_window.protocol("WM_DELETE_WINDOW", on_cancel)
+        progress_window.grab_set()  # 识别期间不能修改区域和模板
+        
+        results_queue = queue.Queue()
+        
+        def worker():
+            scan = None
+            try:
+                pages_to_process = (pages_to_scan or self._pages_to_scan)()
+                results_queue.put(('total', sum(len(page_nums) for _, page_nums in pages_to_process)))
+                # 多进程识别，已缓存的页面直接使用缓存结果；每个工作单元完成后检查是否已取消，
+                # 开始识别前计算文件哈希、查询缓存时每个文件之前也检查，并显示进度
+                scan = iter_scan_cached(pages_to_process, template, self.recognition_cache,
+                                        line_tolerance=line_tolerance, cancel_event=cancel_event,
+                                        progress=lambda *value: results_queue.put(('planning', value)))
+                for item in scan:
+                    results_queue.put(('results', item))
+                    if cancel_event.is_set():
+                        break
+            except Exception as e:
+                results_queue.put(('error', e))
+            finally:
+                if scan is not None:
+                    scan.close()
+                results_queue.put(('done', None))
+        
+        total_pages = 0
+        processed_pages = 0
+        
+        def poll():
+            nonlocal total_pages, processed_pages
+            done = False
+            error = None
             current_file = None
-            
-            for file_path, page_num in pages_to_process:
-                # 如果是新文件，关闭旧文件并打开新文件
-                if current_file != file_path:
-                    if current_pdf:
-                        current_pdf.close()
-                    current_pdf = fitz.open(file_path)
-                    current_file = file_path
-                    
-                    # 更新进度标签
-                    progress_label.config(text=f"正在处理: {os.path.basename(file_path)}")
-                    progress_window.update()
-                    
-                    # 清除当前文件的页码识别结果，但保留文件名区域和其他图幅的结果
-                    if file_path in self.selected_regions:
-                        if self.current_size_key:
-                            # 如果是特定图幅，只清除该图幅的页面结果
-                            self.selected_regions[file_path] = [
-                                region for region in self.selected_regions[file_path]
-                                if region.get('is_filename', False) or  # 保留文件名区域
-                                page_num not in self.page_sizes[file_path].get(self.current_size_key, [])  # 保留其他图幅的结果
-                            ]
-                        else:
-                            # 如果不是特定图幅，保留文件名区域
-                            self.selected_regions[file_path] = [
-                                region for region in self.selected_regions[file_path]
-                                if region.get('is_filename', False)
-                            ]
-                    else:
-                        self.selected_regions[file_path] = []
-                
-                # 获取页面
-                page = current_pdf[page_num]
-                
-                # 计算选择区域在PDF坐标系中的位置
-                zoom = 2.0 * self.scale_factor
-                
-                # 提取页码文本
-                x1, y1, x2, y2 = self.current_page_coords
-                pdf_rect1 = fitz.Rect(x1/zoom, y1/zoom, x2/zoom, y2/zoom)
-                current_text = page.get_text("text", clip=pdf_rect1)
-                
-                # 提取当前页码
-                current_number = self.extract_number_from_text(current_text)
-                
-                if self.template_mode == "double" and self.total_pages_coords:
-                    # 提取总页数
-                    x1, y1, x2, y2 = self.total_pages_coords
-            # 处理每个PDF文件
-            for file_path in self.pdf_files:
-                # 清除当前文件的页码识别结果，但保留文件名区域
-                if file_path in self.selected_regions:
-                    # 只保留文件名区域
-                    self.selected_regions[file_path] = [region for region in self.selected_regions[file_path] 
-                                                     if region.get('is_filename', False)]
+            planning = None
+            while True:
+                try:
+                    kind, value = results_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if kind == 'total':
+                    total_pages = value
+                elif kind == 'planning':
+                    planning = value
+                elif kind == 'results':
+                    current_file, page_nums, results = value
+                    apply_results(current_file, page_nums, results)
+                    processed_pages += len(page_nums)
+                elif kind == 'error':
+                    error = value
                 else:
-                    self.selected_regions[file_path] = []
-                
-                # 打开PDF文件
-                current_pdf = fitz.open(file_path)
-                file_pages = len(current_pdf)
-                
-                progress_label.config(text=f"正在处理: {os.path.basename(file_path)}")
-                progress_window.update()
-                
-                # 遍历当前文件的所有页面
-                for page_num in range(file_pages):
-                    # 获取页面
-                    page = current_pdf[page_num]
-                    
-                    # 计算选择区域在PDF坐标系中的位置
-                    zoom = 2.0 * self.scale_factor
-                    
-                    # 提取页码文本
-                    x1, y1, x2, y2 = self.current_page_coords
-                    pdf_rect1 = fitz.Rect(x1/zoom, y1/zoom, x2/zoom, y2/zoom)
-                    current_text = page.get_text("text", clip=pdf_rect1)
-                    
-                    # 提取当前页码
-                    current_number = self.extract_number_from_text(current_text)
-                    
-                    if self.template_mode == "double" and self.total_pages_coords:
-                        # 提取总页数
-                        x1, y1, x2, y2 = self.total_pages_coords
-                        pdf_rect2 = fitz.Rect(x1/zoom, y1/zoom, x2/zoom, y2/zoom)
-                        total_text = page.get_text("text", clip=pdf_rect2)
-                        total_number = self.extract_number_from_text(total_text)
-                    else:
-                        total_number = None
-                    
-                    if current_number:  # 只要有当前页码就记录
-                        # 查找这个页面是否已有区域（例如文件名区域）
-                        existing_region = None
-                        for i, region in enumerate(self.selected_regions[file_path]):
-                            if region['page'] == page_num:
-                                existing_region = region
-                                existing_index = i
-                                break
-                        
-                        text = f"第 {current_number} 张" + (f" 共 {total_number} 张" if total_number else "")
-                        
-                        if existing_region:
-                            # 如果已有区域，将页码信息添加到现有区域
-                            self.selected_regions[file_path][existing_index].update({
-                                'current_page': current_number,
-                                'total_pages': total_number if total_number else file_pages,
-                                'page_text': text,
-                            })
-                            # 如果不是文件名区域，还要更新text字段
-                            if not existing_region.get('is_filename', False):
-                                self.selected_regions[file_path][existing_index]['text'] = text
-                        else:
-                            # 创建新区域
-                            region = {
-                                'page': page_num,
-                                'rect': self.current_page_coords,
-                                'text': text,
-                                'current_page': current_number,
-                                'total_pages': total_number if total_number else file_pages,
-                                'page_text': text,
-                            }
-                            self.selected_regions[file_path].append(region)
-                            print(f"DEBUG: Added region for {file_path}, page {page_num}: {region}") # Add this line
-                            self.update_region_list()
-                        
-                        total_pages_recognized += 1
-                    
-                    total_pages_processed += 1
-                    # 更新进度
-                    progress = (processed_files * 100.0 / total_files) + (page_num + 1) * 100.0 / (file_pages * total_files)
-                    progress_var.set(progress)
-                    progress_window.update()
-                
-                current_pdf.close()
-                processed_files += 1
+                    done = True
+            
+            if not done:
+                if current_file and not cancel_event.is_set():
+                    progress_label.config(
+                        text=f"正在处理: {os.path.basename(current_file)} ({processed_pages}/{total_pages})")
+                if total_pages and processed_pages:
+                    progress_var.set(processed_pages * 100.0 / total_pages)
+                elif planning and not cancel_event.is_set():
+                    # 还没有识别结果时显示检查文件（计算哈希、查询缓存）的进度
+                    planned_files, total_files, file_path = planning
+                    progress_label.config(
+                        text=f"正在检查: {os.path.basename(file_path)} ({planned_files + 1}/{total_files} 个文件)")
+                    progress_var.set(planned_files * 100.0 / total_files)
+                self.root.after(SCAN_POLL_MS, poll)
+                return
             
-            progress_window.destroy()
+            self.scan_cancel_event = None
+            if progress_window.winfo_exists():
+                progress_window.destroy()
+            
+            if error:
+                self.update_region_list()
+                self.showerror('错误', f'{error_message}：{str(error)}')
+            elif cancel_event.is_set():
+                self.update_region_list()
+                self.template_status.config(text=f'识别已取消 (已处理 {processed_pages}/{total_pages} 页)')
+                self.showinfo('已取消', f'识别已取消，已处理 {processed_pages}/{total_pages} 页，'
+                                     f'这些页面的识别结果已保留。')
+            else:
+                on_finish(processed_pages, total_pages)
+        
+        threading.Thread(target=worker, daemon=True).start()
+        self.root.after(SCAN_POLL_MS, poll)
+    
+    def scan_all_pages(self, only_unscanned=False):
+        """遍历所有PDF文件并识别页码（在后台识别）
+
+        only_unscanned为True时（切换文件时）只识别还没有用当前页码模板识别过的页面，
+        没有这样的页面时直接返回，识别完成后也不弹出提示。
+        """
+        if not self.current_page_coords:  # 至少需要一个坐标
+            return
+        
+        # 只识别页码区域；识别在后台进行，期间区域可能被修改，合并结果时使用开始识别时的区域
+        template = dict(self._build_template(), filename_rects=[])
+        template_key = self._page_template_key(template)
+        size_key = self.current_size_key
+        mode = self.template_mode
+        page_coords = self.current_page_coords
+        total_coords = self.total_pages_coords
+        total_pages_recognized = 0
+        
+        pages_to_scan = None
+        if only_unscanned:
+            if self.scan_cancel_event:
+                return  # 正在进行的识别完成后会记录这些页面
+            pages_to_process = self._pages_to_scan(template_key)
+            if not pages_to_process:
+                return
+            pages_to_scan = lambda: pages_to_process
+        
+        def apply_results(file_path, page_nums, results):
+            nonlocal total_pages_recognized
+            # 清除这些页面之前的页码识别结果，但保留文件名区域
+            self._clear_page_number_results(file_path, page_nums)
+            for page_num, (result, _) in results.items():
+                if result:
+                    self._apply_page_number_result(file_path, page_num, result, page_coords)
+                    total_pages_recognized += 1
+            self._mark_scanned(file_path, template_key, page_nums)
+        
+        def on_finish(processed_pages, total_pages):
+            # 如果正在为特定图幅设置模板，保存模板信息
+            if size_key:
+                self.page_templates[size_key] = {
+                    'mode': mode,
+                    'current_coords': page_coords,
+                    'total_coords': total_coords,
+                }
             
             # 更新区域列表显示
             self.update_region_list()
             
             # 显示识别结果
-            mode_text = "双区域" if self.template_mode == "double" else "单区域"
-            self.template_status.config(text=f'{mode_text}模板设置完成 (已识别 {total_pages_recognized}/{total_pages_processed} 页)')
-            self.showinfo('完成', f'所有文件页码识别完成！\n共识别出 {total_pages_recognized}/{total_pages_processed} 页的页码信息。')
+            mode_text = "双区域" if mode == "double" else "单区域"
+            self.template_status.config(text=f'{mode_text}模板设置完成 (已识别 {total_pages_recognized}/{processed_pages} 页)')
+            if not only_unscanned:
+                self.showinfo('完成', f'所有文件页码识别完成！\n共识别出 {total_pages_recognized}/{processed_pages} 页的页码信息。')
+        
+        self._start_scan("正在识别页码...", template, apply_results, on_finish, '识别页码时出错',
+                         pages_to_scan=pages_to_scan)
+    
+    def rescan_all_templates(self):
+        """使用当前的页码和文件名区域重新识别所有文件，每页只解析一次"""
+        if not self.current_page_coords:
+            self.scan_filename_template()
+            return
+        if not self.filename_template_coords:
+            self.scan_all_pages()
+            return
+        
+        template = self._build_template()
+        template_key = self._page_template_key(template)
+        page_coords = self.current_page_coords
+        filename_coords = self.filename_template_coords.copy()
+        page_numbers_recognized = 0
+        filenames_recognized = 0
+        
+        def apply_results(file_path, page_nums, results):
+            nonlocal page_numbers_recognized, filenames_recognized
+            self._clear_page_number_results(file_path, page_nums)
+            self._mark_scanned(file_path, template_key, page_nums)
+            for page_num, (page_number, filename) in results.items():
+                # 先写入文件名，页码信息再合并到同一个区域
+                self._apply_filename_result(file_path, page_num, filename, filename_coords)
+                if filename:
+                    filenames_recognized += 1
+                if page_number:
+                    self._apply_page_number_result(file_path, page_num, page_number, page_coords)
+                    page_numbers_recognized += 1
+        
+        def on_finish(processed_pages, total_pages):
+            # 更新区域列表显示
+            self.update_region_list()
             
-        except Exception as e:
-            self.showerror('错误', f'识别页码时出错：{str(e)}')
-            if 'progress_window' in locals() and progress_window.winfo_exists():
-                progress_window.destroy()
+            self.showinfo('完成', f'重新识别完成！\n共识别出 {page_numbers_recognized}/{total_pages} 页的页码信息，'
+                                 f'{filenames_recognized}/{total_pages} 页的文件名。')
+        
+        self._start_scan("正在识别页码和文件名...", template, apply_results, on_finish,
+                         '重新识别时出错', line_tolerance=5 / (2.0 * self.scale_factor))
     
     def extract_number_from_text(self, text):
         """从文本中提取数字"""
-        numbers = re.findall(r'\d+', text)
-        return int(numbers[0]) if numbers else None
+        return extract_number_from_text(text)
     
     def start_template_selection(self, mode="double"):
         """开始模板选择过程"""
         if not self.pdf_document:
             self.showwarning('警告', '请先打开PDF文件')
             return
+        if self.scan_cancel_event:
+            self.showwarning("提示", "正在识别，请等待完成或取消后再试")
+            return
         
         # 保存文件名模板状态，以便页码模板选择完成后恢复
         saved_filename_template_mode = self.filename_template_mode 
@@ -1165,6 +1535,58 @@ class PDFSplitterApp:
             
         # 下面的操作将在鼠标操作完成后执行
     
+    def start_region_replacement(self):
+        """重新框选一个模板区域（"第n张"、"共m张"或某个文件名区域），保留其他区域
+        
+        修改后重新识别时，没有变化的区域使用缓存的识别结果，只重新识别修改的区域。
+        """
+        if not self.pdf_document:
+            self.showwarning('警告', '请先打开PDF文件')
+            return
+        if self.scan_cancel_event:
+            self.showwarning("提示", "正在识别，请等待完成或取消后再试")
+            return
+        
+        targets = []
+        if self.current_page_coords:
+            if self.template_mode == "double":
+                targets.append(('"第n张"', 'page'))
+                if self.total_pages_coords:
+                    targets.append(('"共m张"', 'total'))
+            else:
+                targets.append(('页码', 'page'))
+        for i in range(len(self.filename_template_coords)):
+            targets.append((f'文件名区域{i + 1}', ('filename', i)))
+        if not targets:
+            self.showwarning('警告', '请先设置页码或文件名提取区域')
+            return
+        
+        buttons = [(label, i) for i, (label, _) in enumerate(targets)] + [("取消", -1)]
+        choice = self.show_custom_messagebox('修改单个区域', '请选择要重新框选的区域：', "question", buttons)
+        if choice is None or choice < 0:
+            return
+        
+        label, self.replace_target = targets[choice]
+        self.selection_step = 0
+        self.filename_template_mode = False
+        self.template_status.config(text=f'请重新框选{label}的位置...')
+        self.showinfo('提示', f'请重新框选{label}的位置')
+    
+    def selected_profile(self):
+        """界面中选择的输出优化方案名称"""
+        label = self.profile_var.get()
+        for name, profile in OPTIMIZE_PROFILES.items():
+            if profile['label'] == label:
+                return name
+        return DEFAULT_OPTIMIZE_PROFILE
+    
+    def selected_target_dpi(self):
+        """界面中选择的图像分辨率，不缩小时返回None"""
+        choice = self.target_dpi_var.get()
+        if choice in TARGET_DPI_CHOICES[1:]:
+            return int(choice.split()[0])
+        return None
+    
     def split_pdf(self):
         """分割所有PDF文件"""
         if not self.pdf_files:
@@ -1194,378 +1616,96 @@ class PDFSplitterApp:
             progress_bar = ttk.Progressbar(progress_window, variable=progress_var, maximum=100)
             progress_bar.pack(fill=tk.X, padx=20, pady=10)
             
-            total_files = len(self.pdf_files)
-            processed_files = 0
+            # 取消后不再开始新的输出文件，已生成的文件记录在任务日志中，下次分割时跳过
+            cancel_event = threading.Event()
             
-            for file_path in self.pdf_files:
-                progress_label.config(text=f"正在处理: {os.path.basename(file_path)}")
+            def on_cancel():
+                cancel_event.set()
+                cancel_btn.config(state=tk.DISABLED)
+                progress_label.config(text="正在取消...")
+            
+            cancel_btn = ttk.Button(progress_window, text="取消", command=on_cancel)
+            cancel_btn.pack(pady=5)
+            progress_window.protocol("WM_DELETE_WINDOW", on_cancel)
+            
+            def on_progress(done, total, filename):
+                if not cancel_event.is_set():
+                    progress_label.config(text=f"正在生成: {filename} ({done}/{total})")
+                progress_var.set(done * 100 / total)
                 progress_window.update()
-                
-                # 处理单个文件
-                self.process_single_file(file_path, output_dir, progress_window)
-                
-                processed_files += 1
-                progress_var.set(processed_files * 100 / total_files)
+            
+            # 多进程生成所有文件的输出，跳过上次已生成且没有变化的文件
+            jobs = [(file_path, self.selected_regions.get(file_path, []), self.custom_filenames.get(file_path, {}))
+                    for file_path in self.pdf_files]
+            image_stats = {}
+            errors = {}  # 出错的文件不影响其他文件的分割
+            journal = SplitJournal(output_dir)
+            all_output_paths = split_files(jobs, output_dir, self.template_mode, on_progress,
+                                           image_stats=image_stats, profile=self.selected_profile(),
+                                           target_dpi=self.selected_target_dpi(), journal=journal,
+                                           cancel_event=cancel_event, errors=errors)
+            skipped_files = [os.path.basename(file_path) for file_path in self.pdf_files
+                             if not all_output_paths[file_path] and file_path not in errors]
             
             progress_window.destroy()
-            self.showinfo("完成", f"所有PDF文件处理完成\n保存到: {output_dir}")
+            
+            if cancel_event.is_set():
+                self.showinfo("已取消", f"分割已取消，已生成的文件保存在: {output_dir}\n再次分割时会跳过这些文件")
+                return
+            
+            if errors:
+                message = f"已处理 {len(self.pdf_files) - len(errors)}/{len(self.pdf_files)} 个PDF文件\n保存到: {output_dir}"
+            else:
+                message = f"所有PDF文件处理完成\n保存到: {output_dir}"
+            if journal.skipped:
+                message += f"\n跳过 {journal.skipped} 个上次已生成的文件"
+            if image_stats:
+                # 打包的程序没有控制台，图像优化结果显示在完成提示中
+                message += f"\n{format_image_stats(image_stats)}"
+            if skipped_files:
+                message += f"\n以下文件没有可分割的内容: {', '.join(skipped_files)}"
+            if errors:
+                failed_text = "\n".join(f"{os.path.basename(file_path)}: {error}" for file_path, error in errors.items())
+                self.showerror("部分文件处理失败", f"{message}\n\n以下文件处理失败:\n{failed_text}")
+                return
+            self.showinfo("完成", message)
             
         except Exception as e:
             self.showerror("错误", f"处理文件时出错：{str(e)}")
             if 'progress_window' in locals() and progress_window.winfo_exists():
                 progress_window.destroy()
 
-    def process_single_file(self, file_path, output_dir, progress_window=None):
-        """处理单个PDF文件"""
-        # 获取该文件的区域信息
-        regions = self.selected_regions.get(file_path, [])
-        custom_filenames = self.custom_filenames.get(file_path, {})
-        
-        # 打开PDF文件
-        pdf_document = fitz.open(file_path)
-        total_pages = len(pdf_document)
-        
-        try:
-            # 如果没有任何区域信息，但有自定义文件名，则尝试根据自定义文件名分割
-            if (not regions or all(region.get('is_filename', False) for region in regions)) and custom_filenames:
-                result = self.process_by_filenames(file_path, output_dir, custom_filenames, progress_window)
-                if result:  # 如果成功处理了，直接返回
-                    return
-                # 如果处理失败（比如所有页面都是无内容），继续执行下面的逻辑
-            
-            # 如果只有一页，且没有识别到任何内容或区域，直接复制整个文件
-            if total_pages == 1 and (not regions or all(not region.get('text', '').strip() for region in regions)):
-                output_filename = os.path.splitext(os.path.basename(file_path))[0] + "_完整文件.pdf"
-                output_path = os.path.join(output_dir, output_filename)
-                
-                # 直接复制整个文件
-                output_doc = fitz.open()
-                output_doc.insert_pdf(pdf_document)
-                self.optimize_and_save_pdf(output_doc, output_path)
-                output_doc.close()
-                return
-            
-            base_name = os.path.splitext(os.path.basename(file_path))[0]
-            
-            if self.template_mode == "double":
-                # 双区域模式的处理逻辑
-                documents = self.process_double_mode(regions)
-            else:
-                # 单区域模式的处理逻辑
-                documents = self.process_single_mode(regions)
-            
-            # 创建分割后的PDF文件
-            for i, doc_info in enumerate(documents, 1):
-                # 更新进度信息
-                if progress_window:
-                    progress_window.update()
-                
-                output_doc = fitz.open()
-                
-                if self.template_mode == "double":
-                    total_pages, pages = doc_info
-                    for page_index, current_page in pages:
-                        output_doc.insert_pdf(pdf_document, from_page=page_index, to_page=page_index)
-                    first_page = pages[0][1]
-                    last_page = pages[-1][1]
-                    
-                    # 检查是否有自定义文件名
-                    custom_name = None
-                    if file_path in self.custom_filenames and pages[0][0] in self.custom_filenames[file_path]:
-                        custom_name = self.custom_filenames[file_path][pages[0][0]]
-                    
-                    if custom_name and custom_name != "[无内容]":
-                        output_filename = f"{custom_name}.pdf"
-                    else:
-                        output_filename = f"{base_name}_{i:02d}_第{first_page}至{last_page}张共{total_pages}张.pdf"
-                else:
-                    start_page, end_page, page_numbers = doc_info
-                    for page_index in range(start_page, end_page + 1):
-                        output_doc.insert_pdf(pdf_document, from_page=page_index, to_page=page_index)
-                    
-                    # 检查是否有自定义文件名
-                    custom_name = None
-                    if file_path in self.custom_filenames and start_page in self.custom_filenames[file_path]:
-                        custom_name = self.custom_filenames[file_path][start_page]
-                    
-                    if custom_name and custom_name != "[无内容]":
-                        output_filename = f"{custom_name}.pdf"
-                    else:
-                        output_filename = f"{base_name}_{i:02d}_第{page_numbers[0]}至{page_numbers[-1]}张.pdf"
-                    
-                    # 使用更优化的参数保存PDF
-                    output_path = os.path.join(output_dir, output_filename)
-                    
-                    # 调用自定义优化方法
-                    self.optimize_and_save_pdf(output_doc, output_path)
-                    
-                    output_doc.close()
-            
-        finally:
-            pdf_document.close()
 
-    def process_by_filenames(self, file_path, output_dir, custom_filenames, parent_progress_window=None):
-        """根据连续的相同文件名来分割PDF"""
-        try:
-            # 打开PDF文件
-            pdf_document = fitz.open(file_path)
-            base_name = os.path.splitext(os.path.basename(file_path))[0]
-            
-            # 过滤掉标记为无内容的页面
-            valid_filenames = {page_num: name for page_num, name in custom_filenames.items() 
-                             if name != "[无内容]"}
-            
-            if not valid_filenames:
-                self.showwarning("警告", "没有找到有效的文件名，无法进行分割。")
-                return False
-            
-            # 按页码排序自定义文件名
-            sorted_pages = sorted(valid_filenames.keys())
-            
-            if not sorted_pages:
-                return False
-            
-            # 按文件名组织页面
-            current_name = valid_filenames[sorted_pages[0]]
-            start_page = sorted_pages[0]
-            groups = []
-            
-            # 遍历所有页面，将连续相同文件名的页面分为一组
-            for i in range(1, len(sorted_pages)):
-                page_num = sorted_pages[i]
-                current_filename = valid_filenames[page_num]
-                
-                # 如果文件名变化或者页面不连续，创建一个新组
-                if current_filename != current_name or page_num != sorted_pages[i-1] + 1:
-                    groups.append((start_page, sorted_pages[i-1], current_name))
-                    start_page = page_num
-                    current_name = current_filename
-            
-            # 添加最后一组
-            groups.append((start_page, sorted_pages[-1], current_name))
-            
-            # 使用父进度窗口或创建新窗口
-            local_progress_window = None
-            progress_label = None
-            progress_var = None
-            
-            if parent_progress_window:
-                # 使用父窗口中的标签
-                progress_label = parent_progress_window.winfo_children()[0]
-                progress_var = None  # 使用父窗口的进度条
-            else:
-                # 创建新的进度窗口
-                local_progress_window = tk.Toplevel(self.root)
-                local_progress_window.title("生成PDF中")
-                local_progress_window.geometry("300x150")
-                local_progress_window.transient(self.root)  # 设置为主窗口的子窗口
-                self.center_dialog(local_progress_window)  # 居中显示
-                
-                progress_label = ttk.Label(local_progress_window, text="正在生成PDF文件...")
-                progress_label.pack(pady=10)
-                
-                progress_var = tk.DoubleVar()
-                progress_bar = ttk.Progressbar(local_progress_window, variable=progress_var, maximum=100)
-                progress_bar.pack(fill=tk.X, padx=20, pady=10)
-            
-            # 创建分割后的PDF文件
-            for i, (start, end, name) in enumerate(groups, 1):
-                # 更新进度标签
-                if progress_label:
-                    progress_label.config(text=f"正在生成: {name}.pdf ({i}/{len(groups)})")
-                
-                # 更新进度条
-                if progress_var:
-                    progress_var.set(i * 100 / len(groups))
-                
-                # 更新窗口
-                if local_progress_window:
-                    local_progress_window.update()
-                elif parent_progress_window:
-                    parent_progress_window.update()
-                
-                output_doc = fitz.open()
-                
-                # 添加页面到新文档
-                for page_index in range(start, end + 1):
-                    output_doc.insert_pdf(pdf_document, from_page=page_index, to_page=page_index)
-                
-                # 使用识别的文件名
-                output_filename = f"{name}.pdf"
-                
-                # 清理文件名中的非法字符
-                output_filename = re.sub(r'[\\/*?:"<>|]', '_', output_filename)
-                
-                output_path = os.path.join(output_dir, output_filename)
-                
-                # 使用优化方法
-                self.optimize_and_save_pdf(output_doc, output_path)
-                
-                output_doc.close()
-            
-            if local_progress_window:
-                local_progress_window.destroy()
-                
-            pdf_document.close()
-            
-            # 只有在使用本地窗口时才显示完成消息
-            if not parent_progress_window:
-                self.showinfo("完成", f"根据文件名分割完成，共生成 {len(groups)} 个文件。")
-            
-            return True
-            
-        except Exception as e:
-            self.showerror("错误", f"按文件名分割时出错：{str(e)}")
-            if 'local_progress_window' in locals() and local_progress_window:
-                local_progress_window.destroy()
-            return False
-            
-    def optimize_and_save_pdf(self, doc, output_path):
-        """优化PDF文件并保存
-        
-        应用多种优化技术来减小PDF文件大小：
-        - 垃圾回收：移除未使用的对象
-        - 压缩：对PDF内容进行压缩
-        - 清理：移除冗余对象
-        - 优化图像：对图像应用压缩
-        """
-        try:
-            # 第一步：优化每一页中的图像
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                
-                # 获取页面上的图像对象
-                img_list = page.get_images(full=True)
-                for img_index, img_info in enumerate(img_list):
-                    try:
-                        xref = img_info[0]  # 图像的xref号
-                        
-                        # 获取图像数据
-                        base_image = doc.extract_image(xref)
-                        if not base_image:
-                            continue
-                            
-                        image_bytes = base_image["image"]
-                        image_ext = base_image["ext"]
-                        
-                        # 仅处理像素图像格式（不处理矢量图像）
-                        if image_ext.lower() in ("jpg", "jpeg", "png"):
-                            # 使用PIL打开图像
-                            img = Image.open(io.BytesIO(image_bytes))
-                            
-                            # 确定合适的压缩质量
-                            # 根据图像大小动态调整质量：越大的图像使用越低的质量
-                            img_size = len(image_bytes) / 1024  # KB
-                            
-                            if img_size > 1000:  # > 1MB
-                                quality = 65
-                            elif img_size > 500:  # > 500KB
-                                quality = 75
-                            elif img_size > 100:  # > 100KB
-                                quality = 80
-                            else:
-                                quality = 85
-                            
-                            # 创建内存缓冲区存储压缩图像
-                            output_buffer = io.BytesIO()
-                            if image_ext.lower() in ("jpg", "jpeg"):
-                                img.save(output_buffer, format="JPEG", quality=quality, optimize=True)
-                            elif image_ext.lower() == "png":
-                                img.save(output_buffer, format="PNG", optimize=True, 
-                                       compress_level=9)  # 最高压缩级别
-                            
-                            compressed_bytes = output_buffer.getvalue()
-                            
-                            # 如果压缩成功并且新的图像比原始图像小，则替换
-                            if len(compressed_bytes) < len(image_bytes):
-                                # 替换原图像
-                                doc.update_image(xref, compressed_bytes)
-                    except Exception:
-                        # 如果处理单个图像出错，继续处理其他图像
-                        continue
-            
-            # 第二步：使用PyMuPDF的内置优化功能保存PDF
-            doc.save(
-                output_path,
-                garbage=4,         # 最高级别的垃圾收集
-                deflate=True,      # 使用压缩
-                clean=True,        # 清理和优化结构
-                pretty=False,      # 不美化（节省空间）
-                ascii=False,       # 使用二进制格式（更紧凑）
-                compress=True      # 压缩文件流
+    def save_template_file(self):
+        """将当前的页码和文件名提取区域保存为模板文件"""
+        default_template = self._build_template()
+        size_templates = {}
+        for size_key in set(self.page_templates) | set(self.filename_templates):
+            page_template = self.page_templates.get(size_key, {})
+            size_templates[size_key] = make_template(
+                mode=page_template.get('mode'),
+                page_rect=self._to_pdf_rect(page_template['current_coords']) if page_template.get('current_coords') else None,
+                total_rect=self._to_pdf_rect(page_template['total_coords']) if page_template.get('total_coords') else None,
+                filename_rects=[self._to_pdf_rect(coords) for coords in self.filename_templates.get(size_key, [])],
             )
-            
-            return True
         
-        except Exception as e:
-            print(f"优化PDF时出错: {str(e)}")
-            # 如果优化失败，使用基本设置保存
-            doc.save(output_path, garbage=4, deflate=True)
-            return False
-
-    def process_double_mode(self, regions):
-        """处理双区域模式的页面分组"""
-        documents = []
-        temp_docs = {}
-        
-        # 对页面进行分组
-        for region in regions:
-            if 'current_page' not in region:
-                continue
-                
-            current_page = region['current_page']
-            total_pages = region['total_pages']
-            page_index = region['page']
-            
-            doc_start_index = page_index - (current_page - 1)
-            doc_key = (total_pages, doc_start_index)
-            
-            if doc_key not in temp_docs:
-                temp_docs[doc_key] = []
-            temp_docs[doc_key].append((page_index, current_page))
-        
-        # 将分组后的文档转换为列表
-        for (total_pages, _), pages in temp_docs.items():
-            pages.sort(key=lambda x: x[1])
-            documents.append((total_pages, pages))
-        
-        # 按文档第一页的页码排序
-        documents.sort(key=lambda x: x[1][0][1])
-        return documents
-
-    def process_single_mode(self, regions):
-        """处理单区域模式的页面分组"""
-        documents = []
-        current_group = []
-        last_page_number = None
-        
-        # 按页面索引排序
-        sorted_regions = sorted(regions, key=lambda x: x['page'])
-        
-        for region in sorted_regions:
-            current_number = region['current_page']
-            
-            # 如果是第一个页码或者页码序列断开（重新从1开始），创建新组
-            if last_page_number is None or current_number == 1:
-                if current_group:
-                    start_page = current_group[0]['page']
-                    end_page = current_group[-1]['page']
-                    page_numbers = [r['current_page'] for r in current_group]
-                    documents.append((start_page, end_page, page_numbers))
-                current_group = [region]
-            else:
-                current_group.append(region)
-            
-            last_page_number = current_number
+        if not default_template['page_rect'] and not default_template['filename_rects'] and not size_templates:
+            self.showwarning("警告", "请先设置页码或文件名提取区域")
+            return
         
-        # 处理最后一组
-        if current_group:
-            start_page = current_group[0]['page']
-            end_page = current_group[-1]['page']
-            page_numbers = [r['current_page'] for r in current_group]
-            documents.append((start_page, end_page, page_numbers))
+        file_path = filedialog.asksaveasfilename(
+            title="保存模板",
+            defaultextension=".json",
+            filetypes=[("模板文件", "*.json"), ("所有文件", "*.*")]
+        )
+        if not file_path:
+            return
         
-        return documents
+        try:
+            save_templates(file_path, {'default': default_template, 'sizes': size_templates})
+            self.showinfo("提示", f"模板已保存到：\n{file_path}")
+        except Exception as e:
+            self.showerror("错误", f"保存模板时出错：{str(e)}")
 
     def set_output_dir(self):
         """设置输出目录"""
@@ -1582,13 +1722,16 @@ class PDFSplitterApp:
         if not self.pdf_document:
             self.showwarning('警告', '请先打开PDF文件')
             return
+        if self.scan_cancel_event:
+            self.showwarning("提示", "正在识别，请等待完成或取消后再试")
+            return
             
         self.filename_template_mode = True
         self.filename_template_coords = []  # 重置为空列表
         self.template_region_count = 0
         
         # 清除之前的选择框
-        self.canvas.delete("filename_region_*")
+        self.canvas.delete("filename_region")
         
         # 如果当前正在为特定图幅尺寸设置模板，显示相应的提示
         if self.current_size_key:
@@ -1677,7 +1820,7 @@ class PDFSplitterApp:
             else:
                 # 如果没有选择任何区域，则完全取消
                 self.filename_template_mode = False
-                self.canvas.delete("filename_region_*")
+                self.canvas.delete("filename_region")
         
         style = ttk.Style()
         style.configure("Accent.TButton", font=("Arial", 10))
@@ -1790,163 +1933,39 @@ class PDFSplitterApp:
         dialog.wait_window()  # 等待对话框关闭
 
     def scan_filename_template(self):
-        """扫描所有文件的文件名模板区域"""
+        """扫描所有文件的文件名模板区域（在后台识别）"""
         if not self.filename_template_coords:
             return
         
-        try:
-            # 显示进度窗口
-            progress_window = tk.Toplevel(self.root)
-            progress_window.title("识别进度")
-            progress_window.geometry("300x150")
-            progress_window.transient(self.root)  # 设置为主窗口的子窗口
-            self.center_dialog(progress_window)  # 居中显示
-            
-            progress_label = ttk.Label(progress_window, text="正在识别文件名...")
-            progress_label.pack(pady=10)
-            
-            progress_var = tk.DoubleVar()
-            progress_bar = ttk.Progressbar(progress_window, variable=progress_var, maximum=100)
-            progress_bar.pack(fill=tk.X, padx=20, pady=10)
-            
-            # 计算需要处理的页面
-            pages_to_process = []  # [(file_path, page_num), ...]
-            for file_path in self.pdf_files:
-                if self.current_size_key:
-                    # 如果是为特定图幅设置模板，只处理该图幅的页面
-                    if self.current_size_key in self.page_sizes[file_path]:
-                        page_nums = self.page_sizes[file_path][self.current_size_key]
-                        pages_to_process.extend([(file_path, page_num) for page_num in page_nums])
-                else:
-                    # 如果不是特定图幅，处理所有页面
-                    pdf = fitz.open(file_path)
-                    pages_to_process.extend([(file_path, i) for i in range(len(pdf))])
-                    pdf.close()
-            
-            total_pages = len(pages_to_process)
-            processed_pages = 0
-            total_pages_recognized = 0
-            
-            # 处理每个页面
-            current_pdf = None
-            current_file = None
-            
-            for file_path, page_num in pages_to_process:
-                # 如果是新文件，关闭旧文件并打开新文件
-                if current_file != file_path:
-                    if current_pdf:
-                        current_pdf.close()
-                    current_pdf = fitz.open(file_path)
-                    current_file = file_path
-                    
-                    progress_label.config(text=f"正在处理: {os.path.basename(file_path)}")
-                    progress_window.update()
-                    
-                    # 确保文件的区域列表已初始化
-                    if file_path not in self.selected_regions:
-                        self.selected_regions[file_path] = []
-                    if file_path not in self.custom_filenames:
-                        self.custom_filenames[file_path] = {}
-                
-                # 获取页面
-                page = current_pdf[page_num]
-                
-                # 计算选择区域在PDF坐标系中的位置
-                zoom = 2.0 * self.scale_factor
-                
-                # 保持原始选择顺序提取文本
-                combined_text = []
-                
-                # 按照用户框选的原始顺序提取文本
-                for coords in self.filename_template_coords:
-                    x1, y1, x2, y2 = coords
-                    pdf_rect = fitz.Rect(x1/zoom, y1/zoom, x2/zoom, y2/zoom)
-                    
-                    # 提取文本并清理
-                    text = self.extract_text_from_region(page, pdf_rect)
-                    if text:
-                        combined_text.append(text)
-                
-                # 使用所有框选区域的坐标
-                all_coords = self.filename_template_coords
-                
-                # 组合所有区域的文本，用"-"连接
-                if combined_text:
-                    final_text = "-".join(combined_text)
-                    # 清理非法文件名字符
-                    final_text = re.sub(r'[\\/*?:"<>|]', '_', final_text)
-                    self.custom_filenames[file_path][page_num] = final_text
+        # 只识别文件名区域
+        template = dict(self._build_template(), page_rect=None, total_rect=None)
+        size_key = self.current_size_key
+        filename_coords = self.filename_template_coords.copy()
+        total_pages_recognized = 0
+        
+        def apply_results(file_path, page_nums, results):
+            nonlocal total_pages_recognized
+            for page_num, (_, filename) in results.items():
+                self._apply_filename_result(file_path, page_num, filename, filename_coords)
+                if filename:
                     total_pages_recognized += 1
-                else:
-                    final_text = ""
-                
-                # 查找这个页面是否已有区域
-                existing_region = None
-                existing_index = -1
-                for i, region in enumerate(self.selected_regions[file_path]):
-                    if region['page'] == page_num:
-                        existing_region = region
-                        existing_index = i
-                        break
-                
-                if existing_region:
-                    # 更新现有区域
-                    self.selected_regions[file_path][existing_index].update({
-                        'all_coords': all_coords,
-                        'is_filename': True,
-                        'filename': final_text if final_text else "[无内容]",
-                        'filename_text': f"文件名: {final_text if final_text else '[无内容]'}"
-                    })
-                    if 'page_text' in existing_region:
-                        self.selected_regions[file_path][existing_index]['text'] = \
-                            f"{existing_region['page_text']} | {final_text if final_text else '[无内容]'}"
-                    else:
-                        self.selected_regions[file_path][existing_index]['text'] = \
-                            f"文件名: {final_text if final_text else '[无内容]'}"
-                else:
-                    # 创建新区域
-                    filename_region = {
-                        'page': page_num,
-                        'rect': all_coords[0],
-                        'all_coords': all_coords,
-                        'text': f"文件名: {final_text if final_text else '[无内容]'}",
-                        'is_filename': True,
-                        'filename': final_text if final_text else "[无内容]",
-                        'filename_text': f"文件名: {final_text if final_text else '[无内容]'}"
-                    }
-                    self.selected_regions[file_path].append(filename_region)
-                
-                # 如果当前正在为特定图幅尺寸设置模板，保存模板信息
-                if self.current_size_key:
-                    if self.current_size_key not in self.filename_templates:
-                        self.filename_templates[self.current_size_key] = []
-                    # 只保存一次模板坐标
-                    if not self.filename_templates[self.current_size_key]:
-                        self.filename_templates[self.current_size_key] = all_coords
-                
-                processed_pages += 1
-                # 更新进度
-                progress = (processed_pages * 100.0) / total_pages
-                progress_var.set(progress)
-                progress_window.update()
-            
-            # 关闭最后打开的PDF文件
-            if current_pdf:
-                current_pdf.close()
-            
-            progress_window.destroy()
+        
+        def on_finish(processed_pages, total_pages):
+            # 如果当前正在为特定图幅尺寸设置模板，保存模板信息
+            if size_key and processed_pages:
+                if not self.filename_templates.get(size_key):
+                    self.filename_templates[size_key] = filename_coords
             
             # 更新区域列表显示
             self.update_region_list()
             
             # 显示识别结果
-            size_text = f" (图幅: {self.current_size_key})" if self.current_size_key else ""
+            size_text = f" (图幅: {size_key})" if size_key else ""
             self.showinfo('完成', f'文件名识别完成{size_text}！\n共识别出 {total_pages_recognized}/{total_pages} 页的文件名。')
-            
-        except Exception as e:
-            self.showerror('错误', f'识别文件名时出错：{str(e)}')
-            if 'progress_window' in locals() and progress_window.winfo_exists():
-                progress_window.destroy()
+        
+        self._start_scan("正在识别文件名...", template, apply_results, on_finish, '识别文件名时出错',
+                         line_tolerance=5 / (2.0 * self.scale_factor))
+
 
     def extract_text_from_region(self, page, rect):
         """Extracts text from a specified region on a page using the helper method."""
@@ -2141,14 +2160,15 @@ class PDFSplitterApp:
         return getattr(dialog, 'result', None)
     
     def redraw_filename_regions(self):
-        """重新绘制文件名模板区域"""
+        """重新绘制文件名模板区域（只更新这些矩形）"""
+        self.canvas.delete("filename_region")
         if not self.filename_template_mode or not self.filename_template_coords:
             return
             
         for i, coords in enumerate(self.filename_template_coords):
             x1, y1, x2, y2 = coords
             self.canvas.create_rectangle(x1, y1, x2, y2, outline="orange", width=2, 
-                                      tags=f"filename_region_{i+1}")
+                                      tags=("overlay", "filename_region", f"filename_region_{i+1}"))
 
     def showinfo(self, title, message):
         """显示信息消息框"""
@@ -2201,22 +2221,9 @@ class PDFSplitterApp:
                 progress_label.config(text=f"正在处理: {os.path.basename(file_path)}")
                 progress_window.update()
                 
-                pdf_doc = fitz.open(file_path)
-                self.page_sizes[file_path] = {}
-                
-                for page_num in range(len(pdf_doc)):
-                    page = pdf_doc[page_num]
-                    # 获取页面尺寸（四舍五入到整数）
-                    width = round(page.rect.width)
-                    height = round(page.rect.height)
-                    size_key = f"{width}x{height}"
-                    
-                    if size_key not in self.page_sizes[file_path]:
-                        self.page_sizes[file_path][size_key] = []
-                    self.page_sizes[file_path][size_key].append(page_num)
-                    all_sizes.add(size_key)
+                self.page_sizes[file_path] = detect_page_sizes(file_path)
+                all_sizes.update(self.page_sizes[file_path])
                 
-                pdf_doc.close()
                 processed_files += 1
                 progress_var.set(processed_files * 100 / total_files)
             
@@ -2230,6 +2237,7 @@ class PDFSplitterApp:
             if 'progress_window' in locals() and progress_window.winfo_exists():
                 progress_window.destroy()
 
+
     def show_size_detection_results(self, all_sizes):
         """显示图幅尺寸识别结果"""
         dialog = tk.Toplevel(self.root)
@@ -2335,12 +2343,16 @@ class PDFSplitterApp:
 
     def start_template_selection_for_size(self, size_key, template_type="page"):
         """为指定尺寸开始模板选择过程"""
+        if self.scan_cancel_event:
+            self.showwarning("提示", "正在识别，请等待完成或取消后再试")
+            return
+        
         # 找到第一个具有该尺寸的页面并显示
         for file_path in self.pdf_files:
             if size_key in self.page_sizes[file_path]:
                 page_num = self.page_sizes[file_path][size_key][0]
-                # 加载对应的文件和页面
-                self.load_pdf_file(self.pdf_files.index(file_path))
+                # 加载对应的文件和页面；马上要框选新的区域，不用旧模板识别
+                self.load_pdf_file(self.pdf_files.index(file_path), scan=False)
                 self.current_page = page_num
                 self.update_page_display()
                 break
@@ -2354,6 +2366,8 @@ class PDFSplitterApp:
             self.template_status.config(text=f"正在为图幅 {size_key} 设置文件名提取区域...")
 
 def main():
+    # 打包为exe后，多进程识别需要此调用
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = PDFSplitterApp(root)
     root.mainloop()